@@ -0,0 +1,162 @@
+#!/usr/bin/env python3.6
+# -*- coding: utf-8 -*-
+
+""" Bulk-load nanopubs directly into ArangoDB
+
+Usage example:
+    sink = ArangoSink(collection, key_fn=hash_nanopub, batch_size=1000, parallel=4)
+    for nanopub in nanopubs:
+        sink.write(nanopub)
+    sink.close()    # raises ArangoLoadError if any batch or document failed to load
+"""
+import json
+import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, MutableMapping, Tuple
+
+from nptool.log_setup import get_logger
+
+log = get_logger()
+
+Nanopub = MutableMapping[str, Any]
+
+
+class ArangoLoadError(Exception):
+    """Raised on close when nanopubs failed to load into ArangoDB"""
+
+
+def is_arango_url(output_fn: str) -> bool:
+    """Is the output_fn an arango://db/collection output target"""
+
+    return bool(output_fn) and output_fn.startswith("arango://")
+
+
+def parse_arango_url(output_fn: str) -> Tuple[str, str]:
+    """Parse arango://db/collection into (db_name, collection_name)"""
+
+    match = re.match(r"arango://([^/]+)/([^/]+)/?$", output_fn)
+    if not match:
+        raise ValueError(
+            f"Arango output must be of the form arango://db/collection, not {output_fn}"
+        )
+
+    return (match.group(1), match.group(2))
+
+
+class ArangoSink(object):
+    """Batch nanopubs and upsert them into an ArangoDB collection using bulk imports
+
+    Each nanopub is stored with its _key set to key_fn(nanopub) (the nanopub hash)
+    so re-loading the same nanopub replaces the existing document.  Up to `parallel`
+    bulk import requests are kept in-flight while the next batch is being filled.
+    """
+
+    def __init__(
+        self,
+        collection,
+        key_fn: Callable[[Nanopub], Any],
+        batch_size: int = 1000,
+        parallel: int = 4,
+    ):
+        self.collection = collection
+        self.key_fn = key_fn
+        self.batch_size = max(batch_size, 1)
+        self.parallel = max(parallel, 1)
+
+        self.batch = {}
+        self.inflight = set()
+        self.executor = ThreadPoolExecutor(max_workers=self.parallel)
+
+        self.stats = {
+            "created": 0,
+            "updated": 0,
+            "errors": 0,
+            "skipped": 0,
+            "batches": 0,
+            "failed_batches": 0,
+        }
+
+    def write(self, nanopub: Nanopub) -> None:
+        """Add nanopub to current batch - skips non-nanopub records, e.g. headers
+
+        Nanopubs whose key cannot be computed, e.g. citation None, are logged and skipped
+        - close() then raises ArangoLoadError.
+        """
+
+        if "nanopub" not in nanopub:
+            return
+
+        try:
+            key = str(self.key_fn(nanopub))
+        except Exception as e:
+            log.error(f"Skipping nanopub - cannot compute key  Error: {e!r}  {json.dumps(nanopub)}")
+            self.stats["skipped"] += 1
+            return
+
+        doc = dict(nanopub)
+        doc["_key"] = key
+
+        # Later duplicates in the same batch win, matching on_duplicate=replace
+        self.batch[key] = doc
+
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Submit current batch as a bulk import, waiting if too many are in-flight"""
+
+        if not self.batch:
+            return
+
+        while len(self.inflight) >= self.parallel:
+            done, self.inflight = wait(self.inflight, return_when=FIRST_COMPLETED)
+            for future in done:
+                self._collect(future)
+
+        docs = list(self.batch.values())
+        self.batch = {}
+        self.inflight.add(self.executor.submit(self._import, docs))
+
+    def close(self) -> None:
+        """Flush remaining nanopubs and wait for all bulk imports to finish
+
+        Raises:
+            ArangoLoadError: if any bulk import failed or any nanopub was skipped or rejected
+        """
+
+        self.flush()
+        for future in self.inflight:
+            self._collect(future)
+        self.inflight = set()
+        self.executor.shutdown()
+
+        log.info("Arango bulk load complete", **self.stats)
+
+        if self.stats["failed_batches"] or self.stats["errors"] or self.stats["skipped"]:
+            raise ArangoLoadError(
+                f"Arango bulk load failed - failed batches: {self.stats['failed_batches']}  "
+                f"document errors: {self.stats['errors']}  "
+                f"skipped without key: {self.stats['skipped']}"
+            )
+
+    def _import(self, docs):
+        return self.collection.import_bulk(
+            docs, on_duplicate="replace", halt_on_error=False, details=True
+        )
+
+    def _collect(self, future) -> None:
+        """Accumulate bulk import results"""
+
+        try:
+            result = future.result()
+        except Exception as e:
+            log.error(f"Arango bulk import failed: {e}")
+            self.stats["failed_batches"] += 1
+            return
+
+        self.stats["batches"] += 1
+        for key in ["created", "updated", "errors"]:
+            self.stats[key] += result.get(key, 0)
+
+        for detail in result.get("details", []):
+            log.error(f"Arango bulk import error: {detail}")
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3.6
+# -*- coding: utf-8 -*-
+
+""" Parse large BELScript files in parallel
+
+The BELScript is split into chunks at SET Citation / UNSET STATEMENT_GROUP
+statements.  Each chunk after the first starts with the SET statements that make
+up the annotation context active at the split and ends with a no-op UNSET so its
+last statement group is flushed exactly as the following SET/UNSET would have
+done.  Chunks are parsed with bel.nanopub.belscripts.parse_belscript in worker
+processes and the nanopubs are yielded in input order, identical to a sequential
+parse.
+
+Usage example:
+    parser = BelscriptParser(workers=4)
+    for nanopub in parser.parse(open("large.belscript", "rt")):
+        ...
+    parser.close()
+"""
+import collections
+import re
+from itertools import chain
+from typing import Any, Iterable, Iterator, List, MutableMapping, Optional, Tuple
+
+import bel.nanopub.belscripts
+from nptool.process_pool import start_process_pool
+
+Nanopub = MutableMapping[str, Any]
+
+# Minimum number of input lines per chunk
+CHUNK_SIZE = 20000
+
+# Flushes pending assertions at the end of a chunk, pops a non-existent annotation
+CHUNK_END = "UNSET __nptool_chunk_end__\n"
+
+SET_RE = re.compile(r"SET\s+(\w+)\s*=")
+
+BOUNDARY_RE = re.compile(r"(SET\s+Citation\b|UNSET\s+\"?STATEMENT_GROUP\b)")
+
+# Only lines starting with these (or with a continuation) change the parser state
+STATEMENT_PREFIXES = ("SET", "UNSET", "DEFINE")
+
+
+def belscript_statements(lines: Iterable[str]) -> Iterator[Tuple[str, List[str]]]:
+    """Yield (statement, raw lines) using the same line handling as parse_belscript
+
+    Multi-line SET statements and continuation lines are joined exactly as the
+    parser joins them, so the raw lines of a statement are never split across chunks.
+    Single lines that can't be SET/UNSET/DEFINE statements or continue onto the next
+    line, i.e. almost all assertion lines, are yielded with an empty statement
+    without running the parser's line handling.
+    """
+
+    lines = iter(lines)
+    raw = []
+
+    def recorded_lines():
+        for line in lines:
+            raw.append(line)
+            yield line
+
+    recorder = recorded_lines()
+    for first_line in lines:
+        if not first_line.startswith(STATEMENT_PREFIXES) and "\\" not in first_line:
+            yield ("", [first_line])
+            continue
+
+        raw.append(first_line)
+        try:
+            # Reads further lines only for a multi-line SET
+            line = next(bel.nanopub.belscripts.set_single_line(chain([first_line], recorder)))
+        except StopIteration:
+            # Unterminated multi-line SET at end of file
+            yield ("", raw[:])
+            return
+
+        line = re.sub(r"\/\/.*?$", "", line)
+        line = line.rstrip()
+
+        # parse_belscript's non-raw "\\\s*$" - a backslash followed by any "s" at the end
+        while re.search(r"\\s*$", line):
+            line = line.replace("\\", "") + next(recorder)
+
+        yield (line, raw[:])
+        raw.clear()
+
+
+def annotation_key(stmt: str) -> Optional[str]:
+    """Annotation key set by a SET statement - the keys of bel.nanopub.belscripts.process_set
+
+    Avoids parsing the annotation value, e.g. the Citation, which only the parser needs.
+    """
+
+    match = SET_RE.match(stmt)
+    if not match:
+        return None
+
+    key = match.group(1)
+    if key == "STATEMENT_GROUP":
+        return "statement_group"
+    elif key == "Citation":
+        return "citation"
+    elif key.lower() in ("support", "evidence"):
+        return "evidence"
+
+    return key
+
+
+def split_belscript(lines: Iterable[str], chunk_size: int = CHUNK_SIZE) -> Iterator[List[str]]:
+    """Split BELScript lines into independently parseable chunks"""
+
+    context = {}  # annotation key -> raw lines of SET statement that set it
+    pending_metadata = False
+
+    chunk = []
+    chunk_lines = 0
+
+    for (stmt, raw) in belscript_statements(lines):
+        if not stmt:
+            # Assertions, comments and blank lines
+            pass
+
+        elif re.match(r"SET DOCUMENT", stmt) or re.match(r"DEFINE", stmt):
+            # Document header is only emitted at the next SET - don't split before that
+            pending_metadata = True
+
+        elif re.match(r"UNSET", stmt) or re.match(r"SET", stmt):
+            if chunk_lines >= chunk_size and not pending_metadata and BOUNDARY_RE.match(stmt):
+                yield chunk + [CHUNK_END]
+
+                chunk = [line for set_raw in context.values() for line in set_raw]
+                chunk_lines = 0
+
+            if re.match(r"UNSET", stmt):
+                # Removes the same annotation keys as when parsing
+                context = bel.nanopub.belscripts.process_unset(stmt, context)
+            else:
+                pending_metadata = False
+                key = annotation_key(stmt)
+                if key:
+                    context[key] = raw
+
+        chunk.extend(raw)
+        chunk_lines += len(raw)
+
+    if chunk:
+        yield chunk
+
+
+def parse_chunk(chunk: List[str]) -> List[Nanopub]:
+    """Parse BELScript chunk - runs in worker process"""
+
+    return list(bel.nanopub.belscripts.parse_belscript(iter(chunk)))
+
+
+class BelscriptParser(object):
+    """Parse BELScript chunks in a pool of worker processes
+
+    Shared by all input files - at most 2 chunks per worker are in-flight per file.
+    Create in the main thread - the worker processes are started immediately.
+    """
+
+    def __init__(self, workers: int = 4, chunk_size: int = CHUNK_SIZE):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.pool = start_process_pool(workers)
+
+    def parse(self, lines: Iterable[str]) -> Iterator[Nanopub]:
+        """Yield nanopubs from BELScript lines in input order"""
+
+        pending = collections.deque()
+        try:
+            for chunk in split_belscript(lines, self.chunk_size):
+                pending.append(self.pool.submit(parse_chunk, chunk))
+                if len(pending) >= self.workers * 2:
+                    yield from pending.popleft().result()
+
+            while pending:
+                yield from pending.popleft().result()
+
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def close(self) -> None:
+        self.pool.shutdown()
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3.6
+# -*- coding: utf-8 -*-
+
+""" Block-compressed (BGZF) JSONLines with a record index for random access and parallel reads
+
+BGZF files are a series of independent gzip members of up to 64KB uncompressed
+data each, so they are still readable as regular *.gz files.  A location in the
+file is a virtual offset:  (compressed block offset << 16) | offset in block.
+
+The sidecar index <fn>.npi is a JSON file recording the virtual offset of the
+first line that starts in each block and the number of records before it.  It
+allows seeking to record N and splitting a file into record ranges that are
+decompressed in parallel.  Records are the non-blank lines - blank lines are
+neither counted nor read.
+
+Usage example:
+    with BgzfWriter("nanopubs.jsonl.gz") as f:    # writes nanopubs.jsonl.gz.npi on close
+        f.write(json.dumps(nanopub) + "\\n")
+
+    index = load_index("nanopubs.jsonl.gz")
+    reader = IndexedReader(workers=4)
+    for nanopub in reader.read("nanopubs.jsonl.gz", index, start=1000000):
+        ...
+"""
+import bisect
+import collections
+import gzip
+import json
+import os
+import re
+import shutil
+import struct
+import zlib
+from itertools import islice
+from typing import Any, Iterator, List, MutableMapping, Optional, Tuple
+
+from nptool.log_setup import get_logger
+from nptool.process_pool import start_process_pool
+
+log = get_logger()
+
+Nanopub = MutableMapping[str, Any]
+
+INDEX_EXT = ".npi"
+INDEX_FORMAT = "nptool-bgzf-index"
+
+# Uncompressed bytes per block - same as bgzip, compressed block always fits in 64KB
+BLOCK_SIZE = 65280
+
+# Number of records read by each worker task
+RECORDS_PER_TASK = 5000
+
+BGZF_MAGIC = b"\x1f\x8b\x08\x04"
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+def index_fn(fn: str) -> str:
+    return fn + INDEX_EXT
+
+
+def compress_block(data: bytes, level: int = 6) -> bytes:
+    """Compress data into a single BGZF block"""
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    bsize = 18 + len(cdata) + 8
+
+    header = struct.pack("<4sIBBH2sHH", BGZF_MAGIC, 0, 0, 255, 6, b"BC", 2, bsize - 1)
+    trailer = struct.pack("<II", zlib.crc32(data) & 0xFFFFFFFF, len(data))
+
+    return header + cdata + trailer
+
+
+def read_block(f, offset: int) -> Tuple[Optional[bytes], int]:
+    """Read and decompress BGZF block at offset
+
+    Returns:
+        (uncompressed data or None at end of file, offset of next block)
+    """
+
+    f.seek(offset)
+    header = f.read(12)
+    if len(header) < 12:
+        return (None, offset)
+
+    if header[:4] != BGZF_MAGIC:
+        raise ValueError(f"Not a BGZF block at offset {offset}")
+
+    xlen = struct.unpack("<H", header[10:12])[0]
+    extra = f.read(xlen)
+
+    bsize = None
+    pos = 0
+    while pos + 4 <= len(extra):
+        (subfield, slen) = struct.unpack("<2sH", extra[pos : pos + 4])
+        if subfield == b"BC":
+            bsize = struct.unpack("<H", extra[pos + 4 : pos + 6])[0] + 1
+        pos += 4 + slen
+
+    if bsize is None:
+        raise ValueError(f"Not a BGZF block at offset {offset} - missing BC field")
+
+    rest = f.read(bsize - 12 - xlen)
+    data = zlib.decompress(rest[:-8], -15)
+
+    return (data, offset + bsize)
+
+
+def is_bgzf(fn: str) -> bool:
+    """Is file block-compressed gzip (BGZF)"""
+
+    try:
+        with open(fn, "rb") as f:
+            header = f.read(18)
+    except OSError:
+        return False
+
+    return header[:4] == BGZF_MAGIC and header[12:14] == b"BC"
+
+
+def is_blank(line: bytes) -> bool:
+    return not line.strip()
+
+
+class BgzfWriter(object):
+    """Text file-like BGZF writer recording an index of record (non-blank line) start offsets
+
+    The index is written to <fn>.npi on close.
+    """
+
+    def __init__(self, fn: str, level: int = 6):
+        self.fn = fn
+        self.level = level
+        self.f = open(fn, "wb")
+
+        self.offset = 0  # compressed offset of current (unflushed) block
+        self.buffer = bytearray()
+        self.records = 0
+        self.at_record_start = True
+        self.line_blank = True  # current line has no content so far
+        self.block_indexed = False
+        self.blocks = []
+
+    def write(self, text: str) -> int:
+        data = text.encode("utf-8")
+
+        pos = 0
+        while pos < len(data):
+            if self.at_record_start and not self.block_indexed:
+                self.blocks.append([self.records, (self.offset << 16) | len(self.buffer)])
+                self.block_indexed = True
+
+            newline = data.find(b"\n", pos)
+            end = len(data) if newline == -1 else newline + 1
+
+            if not is_blank(data[pos:end]):
+                self.line_blank = False
+
+            self.buffer += data[pos:end]
+            self.at_record_start = newline != -1
+            if self.at_record_start:
+                if not self.line_blank:
+                    self.records += 1
+                self.line_blank = True
+
+            while len(self.buffer) >= BLOCK_SIZE:
+                self._flush_block()
+
+            pos = end
+
+        return len(text)
+
+    def _flush_block(self) -> None:
+        block = compress_block(bytes(self.buffer[:BLOCK_SIZE]), self.level)
+        del self.buffer[:BLOCK_SIZE]
+
+        self.f.write(block)
+        self.offset += len(block)
+
+        # The rest of the buffer starts the next block
+        self.block_indexed = False
+
+    def close(self) -> None:
+        if self.buffer:
+            self.f.write(compress_block(bytes(self.buffer), self.level))
+            self.buffer = bytearray()
+        self.f.write(BGZF_EOF)
+        self.f.close()
+
+        records = self.records + (0 if self.line_blank else 1)
+        write_index(self.fn, records, self.blocks)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def write_index(fn: str, records: int, blocks: List[List[int]]) -> dict:
+    """Write sidecar index for BGZF file"""
+
+    index = {
+        "format": INDEX_FORMAT,
+        "version": 1,
+        "size": os.path.getsize(fn),
+        "records": records,
+        "blocks": blocks,
+    }
+
+    with open(index_fn(fn), "wt") as f:
+        json.dump(index, f)
+
+    return index
+
+
+def load_index(fn: str) -> Optional[dict]:
+    """Load sidecar index for BGZF file if it exists and matches the file"""
+
+    if fn == "-" or not os.path.exists(index_fn(fn)):
+        return None
+
+    try:
+        with open(index_fn(fn), "rt") as f:
+            index = json.load(f)
+    except Exception as e:
+        log.warning(f"Could not read index {index_fn(fn)}  Error: {e}")
+        return None
+
+    if index.get("format") != INDEX_FORMAT or index.get("size") != os.path.getsize(fn):
+        log.warning(f"Ignoring out of date index {index_fn(fn)}")
+        return None
+
+    return index
+
+
+def bgzf_copy_fn(fn: str) -> str:
+    """Filename of the BGZF copy of a plain gzip *.jsonl.gz file - x.jsonl.gz -> x.bgzf.jsonl.gz"""
+
+    return re.sub(r"\.jsonl\.gz$", "", fn) + ".bgzf.jsonl.gz"
+
+
+def recompress(fn: str, bgzf_fn: str) -> dict:
+    """Write a BGZF copy with index of a plain gzip *.jsonl.gz file - fn is left unchanged"""
+
+    tmp_fn = bgzf_fn + ".tmp"
+    try:
+        with gzip.open(fn, "rt", newline="") as fin, BgzfWriter(tmp_fn) as fout:
+            shutil.copyfileobj(fin, fout)
+        os.replace(tmp_fn, bgzf_fn)
+        os.replace(index_fn(tmp_fn), index_fn(bgzf_fn))
+    except BaseException:
+        for partial_fn in [tmp_fn, index_fn(tmp_fn)]:
+            if os.path.exists(partial_fn):
+                os.remove(partial_fn)
+        raise
+
+    return load_index(bgzf_fn)
+
+
+def build_index(fn: str) -> dict:
+    """Build sidecar index for a BGZF *.jsonl.gz file - see recompress for plain gzip files"""
+
+    if not is_bgzf(fn):
+        raise ValueError(f"{fn} is not block-compressed (BGZF)")
+
+    blocks = []
+    records = 0
+    at_record_start = True
+    line_blank = True  # current line has no content so far
+    offset = 0
+
+    with open(fn, "rb") as f:
+        while True:
+            (data, next_offset) = read_block(f, offset)
+            if data is None:
+                break
+
+            if data:
+                lines = data.split(b"\n")
+                if at_record_start:
+                    pos = 0
+                else:
+                    # First line starting in block follows the end of the continued line
+                    continued = lines.pop(0)
+                    line_blank = line_blank and is_blank(continued)
+                    pos = len(continued) + 1
+                    if lines:
+                        records += 0 if line_blank else 1
+                        line_blank = True
+
+                if pos < len(data):
+                    blocks.append([records, (offset << 16) | pos])
+
+                if lines:
+                    records += sum(1 for line in lines[:-1] if not is_blank(line))
+                    line_blank = is_blank(lines[-1])
+                at_record_start = data.endswith(b"\n")
+
+            offset = next_offset
+
+    if not line_blank:
+        records += 1
+
+    return write_index(fn, records, blocks)
+
+
+def iter_lines(fn: str, voffset: int = 0) -> Iterator[bytes]:
+    """Yield records (non-blank lines) from BGZF file starting at virtual offset"""
+
+    offset = voffset >> 16
+    within = voffset & 0xFFFF
+    pending = b""
+
+    with open(fn, "rb") as f:
+        while True:
+            (data, offset) = read_block(f, offset)
+            if data is None:
+                break
+
+            if within:
+                data = data[within:]
+                within = 0
+
+            lines = (pending + data).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                if not is_blank(line):
+                    yield line
+
+    if not is_blank(pending):
+        yield pending
+
+
+def locate(index: dict, record: int) -> Tuple[int, int]:
+    """Return (virtual offset, records to skip) to reach record"""
+
+    starts = [block[0] for block in index["blocks"]]
+    idx = bisect.bisect_right(starts, record) - 1
+    if idx < 0:
+        return (0, record)
+
+    (block_record, voffset) = index["blocks"][idx]
+
+    return (voffset, record - block_record)
+
+
+def read_records(fn: str, voffset: int, skip: int, count: int) -> List[Nanopub]:
+    """Read count records after skipping skip records from virtual offset - runs in worker"""
+
+    lines = iter_lines(fn, voffset)
+
+    return [json.loads(line) for line in islice(lines, skip, skip + count)]
+
+
+def plan_tasks(
+    index: dict, start: int = 0, records_per_task: int = RECORDS_PER_TASK
+) -> List[Tuple[int, int, int]]:
+    """Split records from start to end of file into (virtual offset, skip, count) read tasks"""
+
+    tasks = []
+    for first in range(start, index["records"], records_per_task):
+        (voffset, skip) = locate(index, first)
+        tasks.append((voffset, skip, min(records_per_task, index["records"] - first)))
+
+    return tasks
+
+
+class IndexedReader(object):
+    """Read indexed BGZF JSONLines files, decompressing record ranges in worker processes
+
+    Shared by all input files - at most 2 tasks per worker are in-flight per file.
+    Create in the main thread - the worker processes are started immediately.
+    """
+
+    def __init__(self, workers: int = 4, records_per_task: int = RECORDS_PER_TASK):
+        self.workers = workers
+        self.records_per_task = records_per_task
+        self.pool = start_process_pool(workers) if workers > 1 else None
+
+    def read(self, fn: str, index: dict, start: int = 0) -> Iterator[Nanopub]:
+        """Yield nanopubs from record number start in file order"""
+
+        if not self.pool:
+            (voffset, skip) = locate(index, start)
+            for line in islice(iter_lines(fn, voffset), skip, None):
+                yield json.loads(line)
+            return
+
+        pending = collections.deque()
+        try:
+            for (voffset, skip, count) in plan_tasks(index, start, self.records_per_task):
+                pending.append(self.pool.submit(read_records, fn, voffset, skip, count))
+                if len(pending) >= self.workers * 2:
+                    yield from pending.popleft().result()
+
+            while pending:
+                yield from pending.popleft().result()
+
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def close(self) -> None:
+        if self.pool:
+            self.pool.shutdown()
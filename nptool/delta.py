@@ -0,0 +1,159 @@
+#!/usr/bin/env python3.6
+# -*- coding: utf-8 -*-
+
+""" Incremental delta mode - only transform new or changed nanopubs
+
+State is kept in STATE_DIR/delta.sqlite.  Each input nanopub is keyed by a digest
+of its full content plus the active transform options.  If the key was seen in an
+earlier run the stored output is reused, otherwise the nanopub is transformed and
+the output stored with its nanopub hash - the hash of the output, which is the
+_key used for arango://db/collection outputs.  At the end of the run the nanopub
+hashes seen in the previous run but not in this one are written to
+STATE_DIR/deleted_hashes.txt.  Records without a nanopub, e.g. headers, are
+transformed but not tracked.  Outputs of nanopubs whose transform called
+mark_not_reusable(), e.g. after a failed BEL API lookup, are not stored and the
+nanopub is transformed again in the next run.
+
+Usage example:
+    delta = DeltaState("state", options, np_hash_fn=hash_nanopub)
+    output = delta.transform(nanopub, transform_fn)
+    delta.close()
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Callable, MutableMapping, Optional
+
+import nptool
+from nptool.log_setup import get_logger
+
+log = get_logger()
+
+Nanopub = MutableMapping[str, Any]
+
+DELETED_FN = "deleted_hashes.txt"
+
+# Reusable flag of the nanopub being transformed in each thread
+transform_state = threading.local()
+
+
+def mark_not_reusable() -> None:
+    """Don't reuse the output of the nanopub being transformed in this thread, e.g. failed lookup"""
+
+    transform_state.reusable = False
+
+
+def options_fingerprint(options: dict) -> str:
+    """Fingerprint of transform options and nptool version"""
+
+    options = dict(options, nptool_version=nptool.__version__)
+    return hashlib.sha1(json.dumps(options, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class DeltaState(object):
+    """Reuse transformed nanopubs from earlier runs - shared by all worker threads"""
+
+    def __init__(self, state_dir: str, options: dict, np_hash_fn: Callable[[Nanopub], Any]):
+        self.state_dir = state_dir
+        self.np_hash_fn = np_hash_fn
+        self.fingerprint = options_fingerprint(options)
+
+        os.makedirs(state_dir, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(state_dir, "delta.sqlite"), check_same_thread=False)
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS records
+                (key TEXT PRIMARY KEY, np_hash TEXT, output TEXT, run INTEGER,
+                reusable INTEGER NOT NULL DEFAULT 1)"""
+        )
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(records)")]
+        if "reusable" not in columns:
+            self.db.execute("ALTER TABLE records ADD COLUMN reusable INTEGER NOT NULL DEFAULT 1")
+        self.db.execute("CREATE INDEX IF NOT EXISTS records_run ON records (run)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS runs (run INTEGER PRIMARY KEY)")
+
+        self.run = self.db.execute("SELECT COALESCE(MAX(run), 0) + 1 FROM runs").fetchone()[0]
+        self.db.execute("INSERT INTO runs (run) VALUES (?)", (self.run,))
+
+        self.lock = threading.Lock()
+        self.stats = {"reused": 0, "transformed": 0, "deleted": 0}
+
+    def content_key(self, nanopub: Nanopub) -> str:
+        """Digest of nanopub content and transform options"""
+
+        content = json.dumps(nanopub, sort_keys=True)
+        return hashlib.sha1(f"{self.fingerprint}:{content}".encode()).hexdigest()
+
+    def transform(
+        self, nanopub: Nanopub, transform_fn: Callable[[Nanopub], Optional[Nanopub]]
+    ) -> Optional[Nanopub]:
+        """Return stored output for unchanged nanopubs, otherwise transform_fn(nanopub)"""
+
+        if "nanopub" not in nanopub:
+            return transform_fn(nanopub)
+
+        # Key the input before transform_fn modifies it in place
+        key = self.content_key(nanopub)
+
+        with self.lock:
+            row = self.db.execute(
+                "SELECT output FROM records WHERE key = ? AND reusable", (key,)
+            ).fetchone()
+            if row:
+                self.db.execute("UPDATE records SET run = ? WHERE key = ?", (self.run, key))
+                self.stats["reused"] += 1
+                return json.loads(row[0]) if row[0] is not None else None
+
+        transform_state.reusable = True
+        output = transform_fn(nanopub)
+        reusable = transform_state.reusable
+
+        np_hash = None
+        if output is not None:
+            try:
+                np_hash = str(self.np_hash_fn(output))
+            except Exception as e:
+                # Not loadable (the Arango sink skips it as well) so never reported as deleted
+                log.warning(f"Cannot compute nanopub hash  Error: {e!r}")
+
+        # Unreusable outputs are not stored but their hash is still tracked for deletes
+        stored_output = json.dumps(output) if output is not None and reusable else None
+        with self.lock:
+            self.db.execute(
+                """INSERT OR REPLACE INTO records (key, np_hash, output, run, reusable)
+                    VALUES (?, ?, ?, ?, ?)""",
+                (key, np_hash, stored_output, self.run, int(reusable)),
+            )
+            self.stats["transformed"] += 1
+
+        return output
+
+    def close(self) -> dict:
+        """Write deleted nanopub hashes, prune records not seen in this run and save state
+
+        Returns:
+            stats of reused, transformed and deleted nanopubs
+        """
+
+        with self.lock:
+            deleted = self.db.execute(
+                """SELECT DISTINCT np_hash FROM records
+                    WHERE run < ? AND np_hash IS NOT NULL AND np_hash NOT IN
+                    (SELECT np_hash FROM records WHERE run = ? AND np_hash IS NOT NULL)
+                    ORDER BY np_hash""",
+                (self.run, self.run),
+            ).fetchall()
+
+            with open(os.path.join(self.state_dir, DELETED_FN), "wt") as f:
+                for (np_hash,) in deleted:
+                    f.write(f"{np_hash}\n")
+            self.stats["deleted"] = len(deleted)
+
+            self.db.execute("DELETE FROM records WHERE run < ?", (self.run,))
+            self.db.commit()
+            self.db.close()
+
+        log.info("Delta run complete", run=self.run, **self.stats)
+
+        return self.stats
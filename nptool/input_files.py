@@ -0,0 +1,126 @@
+#!/usr/bin/env python3.6
+# -*- coding: utf-8 -*-
+
+""" Expand input_fn options into the list of nanopub files to process
+
+Usage example:
+    for (input_fn, rel_fn) in expand_input_fns(["data/", "more/*.belscript", "@files.txt"]):
+        output_fn = mirror_output_fn("output", rel_fn)
+"""
+import glob
+import os
+import re
+from typing import Dict, Iterable, List, Tuple
+
+# Nanopub files that are picked up when a directory is given as input
+INPUT_FILE_RE = re.compile(r"\.(jsonl|json|ya?ml|belscript)(\.gz)?$")
+
+
+def has_glob(fn: str) -> bool:
+    return bool(re.search(r"[*?[]", fn))
+
+
+def glob_root(pattern: str) -> str:
+    """Directory portion of a glob pattern before the first wildcard"""
+
+    root = []
+    for part in pattern.split(os.sep):
+        if has_glob(part):
+            break
+        root.append(part)
+
+    return os.sep.join(root) or "."
+
+
+def relative_fn(fn: str, root: str = ".") -> str:
+    """Filename relative to root, or the basename if fn is outside of root"""
+
+    rel_fn = os.path.relpath(fn, root)
+    if rel_fn.startswith(".."):
+        return os.path.basename(fn)
+
+    return rel_fn
+
+
+def expand_input_fns(input_fns: Iterable[str]) -> List[Tuple[str, str]]:
+    """Expand input_fn options into a list of (input_fn, relative fn)
+
+    Each input_fn option can be:
+        '-' for STDIN
+        a directory - all nanopub files found recursively
+        a glob pattern, e.g. 'data/**/*.jsonl.gz'
+        @filelist - a file listing one input filename per line
+        a filename
+
+    The relative fn is used to mirror the input tree in an output directory.
+    """
+
+    files = []
+    for input_fn in input_fns:
+        if input_fn == "-":
+            files.append(("-", "-"))
+
+        elif input_fn.startswith("@"):
+            with open(input_fn[1:], "rt") as f:
+                for line in f:
+                    fn = line.strip()
+                    if fn and not fn.startswith("#"):
+                        files.extend(expand_input_fns([fn]))
+
+        elif os.path.isdir(input_fn):
+            for dirpath, dirnames, filenames in os.walk(input_fn):
+                dirnames.sort()
+                for fn in sorted(filenames):
+                    if INPUT_FILE_RE.search(fn):
+                        fn = os.path.join(dirpath, fn)
+                        files.append((fn, relative_fn(fn, input_fn)))
+
+        elif has_glob(input_fn):
+            root = glob_root(input_fn)
+            for fn in sorted(glob.glob(input_fn, recursive=True)):
+                if os.path.isfile(fn):
+                    files.append((fn, relative_fn(fn, root)))
+
+        else:
+            files.append((input_fn, relative_fn(input_fn)))
+
+    # Drop repeated files, keeping the first occurrence
+    seen = set()
+    unique_files = []
+    for (fn, rel_fn) in files:
+        if fn not in seen:
+            seen.add(fn)
+            unique_files.append((fn, rel_fn))
+
+    return unique_files
+
+
+def mirror_output_fn(output_dir: str, rel_fn: str) -> str:
+    """Output filename mirroring the relative input filename - always *.jsonl.gz"""
+
+    if rel_fn == "-":
+        rel_fn = "stdin"
+
+    return os.path.join(output_dir, INPUT_FILE_RE.sub("", rel_fn) + ".jsonl.gz")
+
+
+def find_output_conflicts(
+    output_dir: str, input_files: List[Tuple[str, str]]
+) -> Dict[str, List[str]]:
+    """Mirrored output filenames shared by more than one input file
+
+    e.g. d1/x.json, d1/x.belscript and d2/x.json all mirror to output_dir/x.jsonl.gz
+
+    Returns:
+        {output fn: [input fns]}
+    """
+
+    input_fns_by_output = {}
+    for (fn, rel_fn) in input_files:
+        input_fns_by_output.setdefault(mirror_output_fn(output_dir, rel_fn), []).append(fn)
+
+    return {
+        output_fn: input_fns
+        for (output_fn, input_fns) in input_fns_by_output.items()
+        if len(input_fns) > 1
+    }
@@ -8,8 +8,13 @@ import gzip
 import json
 import os
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from itertools import islice
 from time import sleep
-from typing import Any, Iterator, MutableMapping
+from typing import Any, Callable, Iterator, List, MutableMapping, Optional, Tuple
 
 import bel.lang.migrate_1_2
 import bel.nanopub.belscripts
@@ -21,7 +26,15 @@ import click
 import yaml
 from arango import ArangoClient
 from bel import BEL
+from nptool.arango_sink import ArangoLoadError, ArangoSink, is_arango_url, parse_arango_url
+from nptool.belscript_chunks import BelscriptParser
+from nptool.bgzf import BgzfWriter, IndexedReader, bgzf_copy_fn, is_bgzf, load_index, recompress
+from nptool.bgzf import build_index as bgzf_build_index
+from nptool.delta import DELETED_FN, DeltaState, mark_not_reusable
+from nptool.input_files import expand_input_fns, find_output_conflicts, mirror_output_fn
 from nptool.log_setup import get_logger
+from nptool.profiling import CpuProfiler, MemProfiler
+from nptool.selection import Selector
 
 # import structlog
 # log = structlog.get_logger()
@@ -30,16 +43,26 @@ log = get_logger()
 
 belapi_url = os.getenv("BELAPI_URL", "https://belapi.thor.biodati.com")
 ARANGO_URL = os.getenv("ARANGO_URL", "http://thor:9529")
+ARANGO_USER = os.getenv("ARANGO_USER", "root")
+ARANGO_PASSWORD = os.getenv("ARANGO_PASSWORD", "")
 
 arango_client = ArangoClient(hosts=f"{ARANGO_URL}")
-pubmed_db = arango_client.db("pubmed2020", username="root", password="")
+pubmed_db = arango_client.db("pubmed2020", username=ARANGO_USER, password=ARANGO_PASSWORD)
 pubmed_json_coll = pubmed_db.collection("json")
 
 
 Nanopub = MutableMapping[str, Any]
-bo = BEL()
+Stage = Tuple[str, Callable[[Nanopub], Optional[Nanopub]]]
 
+# BEL.parse() keeps the parse result on the BEL object - one BEL object per worker thread
+bel_local = threading.local()
+
+# bel.lang.migrate_1_2 keeps the assertion being migrated on a module-level BEL object
+migrate_lock = threading.Lock()
+
+# Shared across all input files/workers for global dedupe
 np_hashes = {}
+np_hashes_lock = threading.Lock()
 
 schema_fn = "/Users/william/belbio/schemas/schemas/nanopub_bel-1.0.0.yaml"
 
@@ -92,8 +115,11 @@ def typo_check(fn):
         quit()
 
 
-def belscript(fn: str) -> Iterator[Nanopub]:
-    """Convert belscript to nanopubs"""
+def belscript(fn: str, parser: BelscriptParser = None) -> Iterator[Nanopub]:
+    """Convert belscript to nanopubs
+
+    Uses parser to parse chunks of the belscript in parallel worker processes if provided
+    """
 
     typo_check(fn)
 
@@ -107,7 +133,12 @@ def belscript(fn: str) -> Iterator[Nanopub]:
                 log.info(f"Can not open file {fn}  Error: {e}")
                 quit()
 
-        for nanopub in bel.nanopub.belscripts.parse_belscript(f):
+        if parser:
+            nanopubs = parser.parse(f)
+        else:
+            nanopubs = bel.nanopub.belscripts.parse_belscript(f)
+
+        for nanopub in nanopubs:
 
             # print(json.dumps(nanopub, indent=4))
 
@@ -118,6 +149,35 @@ def belscript(fn: str) -> Iterator[Nanopub]:
         quit()
 
 
+def read_input(
+    input_fn: str,
+    belscript_parser: BelscriptParser = None,
+    indexed_reader: IndexedReader = None,
+    offset: int = 0,
+) -> Iterator[Nanopub]:
+    """Read nanopubs from BELScript or JSONLines/JSON/YAML input starting at record offset
+
+    Block-compressed *.jsonl.gz files with an index are read using indexed_reader
+    which seeks directly to the offset and can decompress in parallel
+    """
+
+    if "belscript" in input_fn:
+        nanopubs = belscript(input_fn, belscript_parser)
+    else:
+        index = None
+        if indexed_reader and re.search("gz$", input_fn):
+            index = load_index(input_fn)
+        if index:
+            return indexed_reader.read(input_fn, index, offset)
+
+        nanopubs = bel.nanopub.files.read_nanopubs(input_fn)
+
+    if offset:
+        nanopubs = islice(nanopubs, offset, None)
+
+    return nanopubs
+
+
 def migrate1to2(nanopub: Nanopub) -> Nanopub:
     """Convert Nanopub to BEL 2.0.0 from BEL 1"""
 
@@ -127,9 +187,9 @@ def migrate1to2(nanopub: Nanopub) -> Nanopub:
             belstr = f'{assertion["subject"]} {assertion["relation"]} {assertion["object"]}'
 
             try:
-                nanopub["nanopub"]["assertions"][idx] = bel.lang.migrate_1_2.migrate_into_triple(
-                    belstr
-                )
+                with migrate_lock:
+                    triple = bel.lang.migrate_1_2.migrate_into_triple(belstr)
+                nanopub["nanopub"]["assertions"][idx] = triple
             except Exception as e:
                 log.warning(f"Could not migrate {belstr}:  {str(e)}")
 
@@ -139,6 +199,7 @@ def migrate1to2(nanopub: Nanopub) -> Nanopub:
     return nanopub
 
 
+@lru_cache(maxsize=10000)
 def get_pubmed_json(pmid):
     pubmed = pubmed_json_coll.get(str(pmid))
     return pubmed
@@ -157,7 +218,7 @@ def add_pubmed_info(nanopub: Nanopub) -> Nanopub:
                     pmid = nanopub["nanopub"]["citation"]["database"]["id"]
                     if pmid:
                         # pubmed = bel.nanopub.pubmed.get_pubmed(pmid)
-                        pubmed = get_pubmed_json(pmid)
+                        pubmed = get_pubmed_json(str(pmid))
                         if pubmed:
                             if pubmed["article"].get("authors", False):
                                 nanopub["nanopub"]["citation"]["authors"] = pubmed["article"][
@@ -185,10 +246,20 @@ def add_pubmed_info(nanopub: Nanopub) -> Nanopub:
     return nanopub
 
 
+def get_bel() -> BEL:
+    """BEL object for the current thread"""
+
+    if not hasattr(bel_local, "bo"):
+        bel_local.bo = BEL()
+
+    return bel_local.bo
+
+
 def reformat_assertions(nanopub: Nanopub, fmt: str) -> Nanopub:
     """Reformat Assertions to short, medium or long form"""
 
     if "nanopub" in nanopub:
+        bo = get_bel()
         for idx, assertion in enumerate(nanopub["nanopub"]["assertions"]):
             s = assertion["subject"]
             r = assertion.get("relation", "")
@@ -246,6 +317,27 @@ def remap_namespaces(nanopub: Nanopub, ns_mappings) -> Nanopub:
     return nanopub
 
 
+@lru_cache(maxsize=10000)
+def lookup_bel_annotation(label: str, anno_type: str) -> Tuple[str, Optional[str]]:
+    """Lookup BEL Annotation using BEL API - returns (id, label) - label None if no match
+
+    Raises LookupError if the BEL API request fails so that failures are not cached
+    """
+
+    url = f"{belapi_url}/terms/completions/{label}?annotation_types={anno_type}&size=1"
+    resp = bel.utils.get_url(url)
+
+    if resp is None or resp.status_code != 200:
+        status = resp.status_code if resp is not None else "no response"
+        raise LookupError(f"BEL API annotation lookup failed: {url}  Status: {status}")
+
+    result = resp.json()
+    if len(result["completions"]) > 0:
+        return (result["completions"][0]["id"], result["completions"][0]["label"])
+
+    return (f"TBD:{label}", None)
+
+
 def update_bel_annotation(annotation):
     """Update BEL Annotations"""
 
@@ -253,24 +345,16 @@ def update_bel_annotation(annotation):
         log.error("No BEL API defined in the environment - required to update BEL annotations")
         raise SystemExit
 
-    url = f'{belapi_url}/terms/completions/{annotation["label"]}?annotation_types={annotation["type"]}&size=1'
-    resp = bel.utils.get_url(url)
-
-    if resp.status_code == 200:
-        result = resp.json()
-        if len(result["completions"]) > 0:
-            annotation["id"] = result["completions"][0]["id"]
-            if annotation["type"] == "Species":
-                annotation["label"] = result["completions"][0]["label"]
-        else:
-            annotation["id"] = f'TBD:{annotation["label"]}'
-    else:
-        annotation["id"] = f'TBD:{annotation["label"]}'
+    try:
+        (anno_id, anno_label) = lookup_bel_annotation(annotation["label"], annotation["type"])
+    except LookupError as e:
+        log.warning(str(e))
+        (anno_id, anno_label) = (f"TBD:{annotation['label']}", None)
+        mark_not_reusable()
 
-    # print("Url", url)
-    # print(resp.json(), "\n\n")
-    # print("Annotation:", annotation, "\n\n")
-    # quit()
+    annotation["id"] = anno_id
+    if anno_label and annotation["type"] == "Species":
+        annotation["label"] = anno_label
 
     return annotation
 
@@ -315,9 +399,10 @@ def dedupe_nanopubs(nanopub: Nanopub) -> bool:
 
     if "nanopub" in nanopub:
         np_hash = bel.nanopub.nanopubs.hash_nanopub(nanopub)
-        if np_hash in np_hashes:
-            return True
-        np_hashes[np_hash] = 1
+        with np_hashes_lock:
+            if np_hash in np_hashes:
+                return True
+            np_hashes[np_hash] = 1
         return False
     else:
         return False
@@ -342,12 +427,301 @@ def validate_nanopub(nanopub):
     return nanopub
 
 
+class NanopubsWriter(object):
+    """Write nanopubs to STDOUT or a JSONLines, JSON or YAML file"""
+
+    def __init__(self, output_fn: str, bgzf: bool = False):
+        if bgzf and re.search("jsonl.gz$", output_fn):
+            # Block-compressed with index for random access and parallel reads
+            self.out_fh = BgzfWriter(output_fn)
+            (self.yaml_flag, self.jsonl_flag, self.json_flag) = (False, True, False)
+        else:
+            (
+                self.out_fh,
+                self.yaml_flag,
+                self.jsonl_flag,
+                self.json_flag,
+            ) = bel.nanopub.files.create_nanopubs_fh(output_fn)
+
+        self.docs = []
+
+    def write(self, nanopub: Nanopub) -> None:
+        if self.yaml_flag or self.json_flag:
+            self.docs.append(nanopub)
+        else:
+            self.out_fh.write("{}\n".format(json.dumps(nanopub)))
+
+    def close(self) -> None:
+        if self.yaml_flag:
+            yaml.dump(self.docs, self.out_fh)
+        elif self.json_flag:
+            json.dump(self.docs, self.out_fh, indent=4)
+
+        self.out_fh.close()
+
+
+def open_output(
+    output_fn: str, arango_batch_size: int = 1000, arango_parallel: int = 4, bgzf: bool = False
+):
+    """Open output writer - arango://db/collection or output filename"""
+
+    if is_arango_url(output_fn):
+        (db_name, coll_name) = parse_arango_url(output_fn)
+        db = arango_client.db(db_name, username=ARANGO_USER, password=ARANGO_PASSWORD)
+        if not db.has_collection(coll_name):
+            db.create_collection(coll_name)
+
+        return ArangoSink(
+            db.collection(coll_name),
+            key_fn=bel.nanopub.nanopubs.hash_nanopub,
+            batch_size=arango_batch_size,
+            parallel=arango_parallel,
+        )
+
+    return NanopubsWriter(output_fn, bgzf)
+
+
+def drop_duplicate(nanopub: Nanopub) -> Optional[Nanopub]:
+    """Dedupe stage - return None if nanopub already seen"""
+
+    if dedupe_nanopubs(nanopub):
+        log.info("Skipping nanopub as it is a duplicate")
+        return None
+
+    return nanopub
+
+
+def build_pipeline(
+    bel1: bool = False,
+    pubmed: bool = False,
+    fmt: str = None,
+    ns_mappings: dict = None,
+    fix_anno: bool = False,
+    metadata: dict = None,
+    del_md: List[str] = None,
+    dedupe: bool = False,
+    validate: bool = False,
+) -> List[Stage]:
+    """Build list of enabled (name, function) transform stages in order of application
+
+    Each stage function takes a nanopub and returns it or None to drop the nanopub.
+    """
+
+    stages = []
+    if bel1:
+        stages.append(("bel1", migrate1to2))
+    if pubmed:
+        stages.append(("pubmed", add_pubmed_info))
+    if fmt:
+        stages.append(("fmt", lambda np: reformat_assertions(np, fmt)))
+    if ns_mappings:
+        stages.append(("remap", lambda np: remap_namespaces(np, ns_mappings)))
+    if fix_anno:
+        stages.append(("fix_anno", fix_annotations))
+    if metadata or del_md:
+        stages.append(("metadata", lambda np: update_metadata(np, metadata, del_md)))
+    if dedupe:
+        stages.append(("dedupe", drop_duplicate))
+    if validate:
+        stages.append(("validate", validate_nanopub))
+
+    return stages
+
+
+def build_delta_pipeline(
+    delta_state: DeltaState, transform_stages: List[Stage], dedupe: bool = False
+) -> List[Stage]:
+    """Wrap transform stages so outputs are reused for unchanged nanopubs
+
+    Dedupe depends on the other nanopubs in the run so it runs after the delta stage
+    """
+
+    def delta_transform(nanopub: Nanopub) -> Optional[Nanopub]:
+        return delta_state.transform(nanopub, lambda np: transform_nanopub(np, transform_stages))
+
+    stages = [("delta", delta_transform)]
+    if dedupe:
+        stages.append(("dedupe", drop_duplicate))
+
+    return stages
+
+
+def transform_nanopub(nanopub: Nanopub, stages: List[Stage]) -> Optional[Nanopub]:
+    """Run nanopub through transform stages - returns None if a stage dropped it"""
+
+    for (name, stage) in stages:
+        nanopub = stage(nanopub)
+        if nanopub is None:
+            return None
+
+    return nanopub
+
+
+def process_file(
+    input_fn: str,
+    stages: List[Stage],
+    out,
+    out_lock=None,
+    selector: Selector = None,
+    read_options: dict = None,
+) -> dict:
+    """Read, select, transform and write nanopubs from one input file
+
+    out_lock is required when out is shared with other worker threads
+    read_options are passed to read_input
+
+    Returns:
+        summary of nanopubs processed, filtered, dropped and written for input file
+    """
+
+    batches = 100
+    summary = {"input_fn": input_fn, "nanopubs": 0, "filtered": 0, "dropped": 0, "written": 0}
+    start_time = time.time()
+
+    nanopubs = read_input(input_fn, **(read_options or {}))
+    if selector:
+        if selector.limit_reached():
+            nanopubs = []
+        else:
+            nanopubs = selector.select(nanopubs, input_fn, summary)
+
+    for np in nanopubs:
+        if "nanopub" in np:
+            summary["nanopubs"] += 1
+            if summary["nanopubs"] % batches == 0:
+                log.info(f"Processed {summary['nanopubs']} nanopubs from {input_fn}")
+
+        np = transform_nanopub(np, stages)
+        if np is None:
+            summary["dropped"] += 1
+            continue
+
+        if out_lock:
+            with out_lock:
+                out.write(np)
+        else:
+            out.write(np)
+        summary["written"] += 1
+
+    summary["seconds"] = round(time.time() - start_time, 2)
+
+    return summary
+
+
+def print_summary(summaries: List[dict]) -> None:
+    """Print per-file summary to STDERR"""
+
+    click.echo("File summary:", err=True)
+    for summary in summaries:
+        output = f"  -> {summary['output_fn']}" if summary.get("output_fn") else ""
+        click.echo(
+            f"  {summary['input_fn']}{output}  nanopubs: {summary['nanopubs']}  "
+            f"filtered: {summary['filtered']}  dropped: {summary['dropped']}  "
+            f"written: {summary['written']}  "
+            f"seconds: {summary['seconds']}",
+            err=True,
+        )
+
+
 CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
 
 
 @click.command(context_settings=CONTEXT_SETTINGS)
-@click.option("--input_fn", "-i", default="-", help="See input_fn options above")
+@click.option(
+    "--input_fn",
+    "-i",
+    multiple=True,
+    default=["-"],
+    help="See input_fn options above, can add multiple -i options",
+)
 @click.option("--output_fn", "-o", default="-", help="See output_fn options above")
+@click.option(
+    "--output_dir",
+    help="Write a *.jsonl.gz output file per input file mirroring the input tree instead of output_fn",
+)
+@click.option(
+    "--workers",
+    default=1,
+    show_default=True,
+    help="Number of input files to process concurrently",
+)
+@click.option(
+    "--arango_batch_size",
+    default=1000,
+    show_default=True,
+    help="Nanopubs per bulk import request when output_fn is arango://db/collection",
+)
+@click.option(
+    "--arango_parallel",
+    default=4,
+    show_default=True,
+    help="Max bulk import requests in-flight when output_fn is arango://db/collection",
+)
+@click.option(
+    "--filter",
+    "filters",
+    multiple=True,
+    help="Only process nanopubs matching filter, e.g. --filter metadata.project=ABC, see filter options above, can add multiple --filter options (all must match)",
+)
+@click.option(
+    "--sample",
+    type=click.FloatRange(0, 1),
+    help="Only process a random sample of nanopubs, e.g. --sample 0.01 for 1%",
+)
+@click.option("--seed", default=0, show_default=True, help="Random seed for --sample")
+@click.option(
+    "--limit",
+    type=click.IntRange(0),
+    help="Stop reading after N nanopubs have been selected",
+)
+@click.option(
+    "--belscript_workers",
+    default=1,
+    show_default=True,
+    help="Number of processes used to parse each BELScript file in parallel chunks",
+)
+@click.option(
+    "--delta",
+    help="STATE_DIR - only transform new or changed nanopubs, reusing outputs stored in STATE_DIR from earlier runs, see delta above",
+)
+@click.option(
+    "--offset",
+    type=click.IntRange(0),
+    default=0,
+    help="Start reading each input file at record N - seeks directly using the index of block-compressed files",
+)
+@click.option(
+    "--read_workers",
+    default=1,
+    show_default=True,
+    help="Number of processes used to decompress and parse each indexed block-compressed input file",
+)
+@click.option(
+    "--bgzf",
+    is_flag=True,
+    default=False,
+    help="Write *.jsonl.gz output block-compressed (BGZF) with a record index for random access and parallel reads",
+)
+@click.option(
+    "--build_index",
+    is_flag=True,
+    default=False,
+    help="Build record index for the input *.jsonl.gz files and exit - plain gzip files are copied as BGZF to *.bgzf.jsonl.gz and the copy is indexed, the input is left unchanged",
+)
+@click.option(
+    "--profile",
+    help="Write CPU profile of the transform loop to file - pstats format (input files are profiled one at a time) or collapsed stacks for flamegraphs if the filename ends with .folded or .collapsed",
+)
+@click.option(
+    "--memprofile",
+    help="Write allocation growth by source line and by transform stage every --memprofile_every records to file - stage allocations include other --workers threads",
+)
+@click.option(
+    "--memprofile_every",
+    default=10000,
+    show_default=True,
+    help="Number of records between --memprofile snapshots",
+)
 @click.option("--bel1", is_flag=True, default=False, help="Convert BEL1 to BEL 2.0.0")
 @click.option("--pubmed", is_flag=True, default=False, help="Add pubmed info to nanopubs")
 @click.option(
@@ -397,6 +771,23 @@ CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
 def main(
     input_fn,
     output_fn,
+    output_dir,
+    workers,
+    arango_batch_size,
+    arango_parallel,
+    filters,
+    sample,
+    seed,
+    limit,
+    belscript_workers,
+    delta,
+    offset,
+    read_workers,
+    bgzf,
+    build_index,
+    profile,
+    memprofile,
+    memprofile_every,
     bel1,
     pubmed,
     fmt,
@@ -421,6 +812,18 @@ def main(
         IF input fn has *.json*, will be read as a JSON file with an array of Nanopubs
         If input fn has *.yaml* or *.yml*,  read be written as a YAML file
         If input fn has *.belscript* will read as a BELScript file
+            (split at SET Citation/UNSET STATEMENT_GROUP and parsed using --belscript_workers)
+        If input fn has *.jsonl.gz and a *.jsonl.gz.npi index (see --bgzf/--build_index),
+            will read using --read_workers processes and seek directly to --offset
+        If input fn is a directory, will read all of the above files found in it recursively
+        If input fn is a glob pattern, e.g. 'data/**/*.jsonl.gz', will read all matching files
+        If input fn is @filelist, will read each filename listed in filelist (one per line)
+
+        Multiple input files are processed concurrently using --workers threads and
+        written to output_fn in completion order or mirrored into --output_dir.
+        Input files that would mirror to the same output file, e.g. x.json and
+        x.belscript, are reported as an error before any processing.
+        Dedupe and lookup caches are shared across all input files.
 
     \b
     output_fn:
@@ -429,6 +832,29 @@ def main(
         If output fn has *.jsonl*, will written as a JSONLines file
         IF output fn has *.json*, will be written as a JSON file
         If output fn has *.yaml* or *.yml*,  will be written as a YAML file
+        If output fn has *.jsonl.gz and --bgzf, will be written block-compressed with an index
+        If output fn is arango://db/collection, will bulk load into ArangoDB (ARANGO_URL)
+            upserting each nanopub using its nanopub hash as the document _key
+            and exits with an error if any nanopub fails to load (see nptools.log)
+
+    \b
+    filter:
+        Filters, --sample and --limit are applied right after reading, before any
+        other processing. Field paths are relative to the nanopub and step into lists.
+        field=value   any field value equals value, e.g. metadata.project=ABC
+        field!=value  no field value equals value
+        field~regex   any field value matches regex, e.g. citation.database.name~(?i)pubmed
+        field         field exists and is not empty
+
+    \b
+    delta:
+        Each input nanopub is keyed by a digest of its content and the transform options.
+        Outputs stored in STATE_DIR are reused for nanopubs seen in the previous run,
+        only new or changed nanopubs are transformed. The nanopub hashes of the outputs
+        (the arango://db/collection _key) from the previous run missing from this run are
+        written to STATE_DIR/deleted_hashes.txt. Outputs with failed BEL API lookups are not
+        reused - those nanopubs are transformed again in the next run.
+        Requires the full input - cannot be combined with --filter, --sample, --limit or --offset.
 
     \b
     bel1to2: Convert BEL1 to BEL 2.0.0
@@ -485,14 +911,38 @@ default_ns_mappings = {
 }
     """
 
-    cnt = 0
-    batches = 100
-
-    (out_fh, yaml_flag, jsonl_flag, json_flag) = bel.nanopub.files.create_nanopubs_fh(output_fn)
-    # bad_nanopubs_fh = open('bad_nanopubs.json', 'wt')
-
-    if yaml_flag or json_flag:
-        docs = []
+    input_files = expand_input_fns(input_fn)
+    if not input_files:
+        log.error(f"No input files found for {input_fn}")
+        raise SystemExit(1)
+
+    if build_index:
+        for (fn, rel_fn) in input_files:
+            if re.search("jsonl.gz$", fn) and is_bgzf(fn):
+                index = bgzf_build_index(fn)
+                print(f"Indexed {fn}: {index['records']} records in {len(index['blocks'])} blocks")
+            elif re.search("jsonl.gz$", fn):
+                # Plain gzip input is left as is - the BGZF copy is read instead
+                bgzf_fn = bgzf_copy_fn(fn)
+                index = recompress(fn, bgzf_fn)
+                print(
+                    f"Recompressed {fn} as {bgzf_fn}: {index['records']} records in "
+                    f"{len(index['blocks'])} blocks"
+                )
+            else:
+                print(f"Skipping {fn} - only *.jsonl.gz files can be indexed")
+        return
+
+    if output_dir:
+        conflicts = find_output_conflicts(output_dir, input_files)
+        if conflicts:
+            for (file_output_fn, fns) in conflicts.items():
+                log.error(f"Input files {', '.join(fns)} would all be written to {file_output_fn}")
+            (file_output_fn, fns) = next(iter(conflicts.items()))
+            raise click.UsageError(
+                f"{len(conflicts)} output files in --output_dir would be written by more than "
+                f"one input file, e.g. {', '.join(fns)} -> {file_output_fn}"
+            )
 
     # Collect namespace and annotation mappings
     ns_mappings = {}
@@ -511,81 +961,138 @@ default_ns_mappings = {
             (key, val) = md.split("=")
             metadata[key] = val
 
-    if "belscript" in input_fn:
-        for np in belscript(input_fn):
-            if "nanopub" in np:
-                cnt += 1
-
-            if cnt % batches == 0:
-                log.info(f"Processed {cnt} nanopubs")
-
-            if bel1:
-                np = migrate1to2(np)
-            if pubmed:
-                np = add_pubmed_info(np)
-            if fmt:
-                np = reformat_assertions(np, fmt)
-            if ns_mappings:
-                np = remap_namespaces(np, ns_mappings)
-            if fix_anno:
-                np = fix_annotations(np)
-            if metadata or del_md:
-                np = update_metadata(np, metadata, del_md)
-            if dedupe and dedupe_nanopubs(np):
-                continue
-            if validate:
-                np = validate_nanopub(np)
-
-            # print('NP', json.dumps(np, indent=4))
+    transform_options = dict(
+        bel1=bel1,
+        pubmed=pubmed,
+        fmt=fmt,
+        ns_mappings=ns_mappings,
+        fix_anno=fix_anno,
+        metadata=metadata,
+        del_md=del_md,
+        validate=validate,
+    )
+
+    delta_state = None
+    if delta:
+        # Unselected nanopubs would be dropped from the state and reported as deleted
+        partial_options = [
+            option
+            for (option, value) in [
+                ("--filter", filters),
+                ("--sample", sample is not None),
+                ("--limit", limit is not None),
+                ("--offset", offset),
+            ]
+            if value
+        ]
+        if partial_options:
+            raise click.UsageError(
+                "--delta requires the full input - cannot be used with "
+                + ", ".join(partial_options)
+            )
 
-            if yaml_flag or json_flag:
-                docs.append(np)
-            else:
-                out_fh.write("{}\n".format(json.dumps(np)))
+        delta_state = DeltaState(
+            delta, transform_options, np_hash_fn=bel.nanopub.nanopubs.hash_nanopub
+        )
 
-            # if cnt > 5:
-            #     break
+    selector = None
+    if filters or sample is not None or limit is not None:
+        try:
+            selector = Selector(filters=filters, sample=sample, seed=seed, limit=limit)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="--filter")
+
+    belscript_parser = None
+    if belscript_workers > 1 and any(["belscript" in fn for (fn, rel_fn) in input_files]):
+        belscript_parser = BelscriptParser(workers=belscript_workers)
+
+    indexed_reader = IndexedReader(workers=read_workers)
+    read_options = dict(
+        belscript_parser=belscript_parser, indexed_reader=indexed_reader, offset=offset
+    )
+
+    # Started after the worker processes are forked so they don't inherit the profilers
+    cpu_profiler = CpuProfiler(profile) if profile else None
+    mem_profiler = MemProfiler(memprofile, every=memprofile_every) if memprofile else None
+
+    if delta_state:
+        transform_stages = build_pipeline(**transform_options)
+        if mem_profiler:
+            # Report the stages run inside delta for new or changed nanopubs
+            transform_stages = mem_profiler.wrap_stages(transform_stages, count_records=False)
+        stages = build_delta_pipeline(delta_state, transform_stages, dedupe)
     else:
-        for np in bel.nanopub.files.read_nanopubs(input_fn):
-            if "nanopub" in np:
-                cnt += 1
-
-            if cnt % batches == 0:
-                log.info(f"Processed {cnt} nanopubs")
-
-            if bel1:
-                np = migrate1to2(np)
-            if pubmed:
-                np = add_pubmed_info(np)
-            if fmt:
-                np = reformat_assertions(np, fmt)
-            if ns_mappings:
-                np = remap_namespaces(np, ns_mappings)
-            if fix_anno:
-                np = fix_annotations(np)
-            if metadata or del_md:
-                np = update_metadata(np, metadata, del_md)
-
-            if dedupe and dedupe_nanopubs(np):
-                print("Skipping nanopub as it is a duplicate")
-                continue
-            if validate:
-                np = validate_nanopub(np)
+        stages = build_pipeline(dedupe=dedupe, **transform_options)
 
-            if yaml_flag or json_flag:
-                docs.append(np)
-            else:
-                out_fh.write("{}\n".format(json.dumps(np)))
+    if mem_profiler:
+        stages = mem_profiler.wrap_stages(stages)
+
+    out = None
+    out_lock = threading.Lock()
+    if not output_dir:
+        out = open_output(output_fn, arango_batch_size, arango_parallel, bgzf)
+    # bad_nanopubs_fh = open('bad_nanopubs.json', 'wt')
+
+    def run_file(input_file: Tuple[str, str]) -> dict:
+        (fn, rel_fn) = input_file
+        if not output_dir:
+            return process_file(fn, stages, out, out_lock, selector, read_options)
+
+        file_output_fn = mirror_output_fn(output_dir, rel_fn)
+        os.makedirs(os.path.dirname(file_output_fn), exist_ok=True)
+        file_out = NanopubsWriter(file_output_fn, bgzf)
+        try:
+            summary = process_file(
+                fn, stages, file_out, selector=selector, read_options=read_options
+            )
+        finally:
+            file_out.close()
+        summary["output_fn"] = file_output_fn
 
-    if yaml_flag:
-        yaml.dump(docs, out_fh)
+        return summary
 
-    elif json_flag:
-        json.dump(docs, out_fh, indent=4)
+    run = partial(cpu_profiler.run, run_file) if cpu_profiler else run_file
 
+    if workers > 1 and len(input_files) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            summaries = list(executor.map(run, input_files))
+    else:
+        summaries = [run(input_file) for input_file in input_files]
+
+    if cpu_profiler:
+        cpu_profiler.close()
+    if mem_profiler:
+        mem_profiler.close()
+
+    load_error = None
+    if out:
+        try:
+            out.close()
+        except ArangoLoadError as e:
+            load_error = e
+
+    if belscript_parser:
+        belscript_parser.close()
+    indexed_reader.close()
+
+    if delta_state:
+        delta_stats = delta_state.close()
+        click.echo(
+            f"Delta: reused {delta_stats['reused']}  transformed {delta_stats['transformed']}  "
+            f"deleted {delta_stats['deleted']} (see {os.path.join(delta, DELETED_FN)})",
+            err=True,
+        )
+
+    if len(summaries) > 1:
+        print_summary(summaries)
+
+    cnt = sum([summary["nanopubs"] for summary in summaries])
     print(f"Processed {cnt} nanopubs")
 
-    out_fh.close()
+    if load_error:
+        log.error(str(load_error))
+        click.echo(f"Error: {load_error} (see nptools.log)", err=True)
+        raise SystemExit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3.6
+# -*- coding: utf-8 -*-
+
+""" Process pools started up front in the main thread
+
+ProcessPoolExecutor only forks its worker processes as tasks are submitted.  When the
+first submit happens inside a --workers thread, the fork copies a process where other
+threads may be holding locks (logging, imports, the sqlite/arango clients) and the
+child can deadlock.  start_process_pool forks all workers before any threads start.
+
+Usage example:
+    pool = start_process_pool(workers=4)
+"""
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+
+# Long enough that every warm-up task is still running when the last one is submitted
+WARM_UP_SECONDS = 0.05
+
+
+def warm_up() -> None:
+    """Keep a worker busy so the next submit forks another worker"""
+
+    time.sleep(WARM_UP_SECONDS)
+
+
+def start_process_pool(workers: int) -> ProcessPoolExecutor:
+    """Create a ProcessPoolExecutor and fork all of its workers now
+
+    Must be called from the main thread before any worker threads are started.
+    """
+
+    pool = ProcessPoolExecutor(max_workers=workers)
+    wait([pool.submit(warm_up) for _ in range(workers)])
+
+    return pool
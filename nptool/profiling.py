@@ -0,0 +1,201 @@
+#!/usr/bin/env python3.6
+# -*- coding: utf-8 -*-
+
+""" Profiling hooks for the transform loop - only installed when requested
+
+CpuProfiler writes a cProfile pstats file or, for *.folded/*.collapsed filenames,
+collapsed stacks sampled from the transform threads (flamegraph.pl/speedscope input).
+Only one cProfile profiler can be active at a time (enforced from Python 3.12) so
+pstats profiling runs one input file at a time, even with --workers > 1.
+
+MemProfiler uses tracemalloc to report allocation growth by source line and the
+net allocations of each transform stage every N records.  tracemalloc counts the
+allocations of the whole process, so with --workers > 1 a stage's allocations
+include those made by other threads while it ran.
+
+Usage example:
+    cpu_profiler = CpuProfiler("nptool.pstats")
+    summary = cpu_profiler.run(process_file, input_fn, stages, out)
+    cpu_profiler.close()
+
+    mem_profiler = MemProfiler("nptool.memprofile.txt", every=10000)
+    stages = mem_profiler.wrap_stages(stages)
+    ...
+    mem_profiler.close()
+"""
+import collections
+import cProfile
+import pstats
+import sys
+import threading
+import tracemalloc
+from typing import Any, Callable, List, MutableMapping, Optional, Tuple
+
+Nanopub = MutableMapping[str, Any]
+Stage = Tuple[str, Callable[[Nanopub], Optional[Nanopub]]]
+
+COLLAPSED_EXTS = (".folded", ".collapsed")
+
+
+class CpuProfiler(object):
+    """Profile functions run in the transform loop, across all worker threads"""
+
+    def __init__(self, path: str, interval: float = 0.005):
+        self.path = path
+        self.collapsed = path.endswith(COLLAPSED_EXTS)
+        self.lock = threading.Lock()
+
+        self.profile = cProfile.Profile()
+        self.profile_lock = threading.Lock()
+        self.profiled = False
+
+        self.interval = interval
+        self.threads = set()
+        self.stacks = collections.Counter()
+        self.stop = threading.Event()
+        self.sampler = None
+        if self.collapsed:
+            self.sampler = threading.Thread(
+                target=self._sample, name="nptool-profiler", daemon=True
+            )
+            self.sampler.start()
+
+    def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run fn(*args, **kwargs) under the profiler"""
+
+        if self.collapsed:
+            ident = threading.get_ident()
+            with self.lock:
+                self.threads.add(ident)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.threads.discard(ident)
+
+        # One profiler for all threads, running one function at a time
+        with self.profile_lock:
+            self.profiled = True
+            return self.profile.runcall(fn, *args, **kwargs)
+
+    def _sample(self) -> None:
+        """Sample stacks of the profiled threads every interval"""
+
+        while not self.stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self.lock:
+                threads = list(self.threads)
+
+            for ident in threads:
+                frame = frames.get(ident)
+                stack = []
+                while frame:
+                    module = frame.f_globals.get("__name__", "?")
+                    stack.append(f"{module}:{frame.f_code.co_name}")
+                    frame = frame.f_back
+                if stack:
+                    self.stacks[";".join(reversed(stack))] += 1
+
+    def close(self) -> None:
+        """Write profile"""
+
+        if self.collapsed:
+            self.stop.set()
+            self.sampler.join()
+            with open(self.path, "wt") as f:
+                for (stack, count) in self.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+
+        elif self.profiled:
+            pstats.Stats(self.profile).dump_stats(self.path)
+
+
+class MemProfiler(object):
+    """Report allocation growth by source line and transform stage every N records"""
+
+    def __init__(self, path: str, every: int = 10000, top: int = 10):
+        self.every = max(every, 1)
+        self.top = top
+        self.lock = threading.Lock()
+
+        self.records = 0
+        self.stage_bytes = collections.Counter()
+
+        tracemalloc.start()
+        self.previous = self._take_snapshot()
+        self.f = open(path, "wt")
+
+    def wrap_stages(self, stages: List[Stage], count_records: bool = True) -> List[Stage]:
+        """Wrap transform stages to track their allocations and count records
+
+        Nested stages, e.g. those run by the delta stage, are wrapped with count_records=False
+        and their allocations are also included in the outer stage.
+        """
+
+        wrapped = [(name, self._wrap(name, fn)) for (name, fn) in stages]
+        if not count_records:
+            return wrapped
+
+        return [("memprofile", self.tick)] + wrapped
+
+    def _wrap(self, name: str, fn: Callable[[Nanopub], Optional[Nanopub]]):
+        def wrapper(nanopub: Nanopub) -> Optional[Nanopub]:
+            before = tracemalloc.get_traced_memory()[0]
+            result = fn(nanopub)
+            allocated = tracemalloc.get_traced_memory()[0] - before
+            with self.lock:
+                self.stage_bytes[name] += allocated
+            return result
+
+        return wrapper
+
+    def tick(self, nanopub: Nanopub) -> Nanopub:
+        """Count record and snapshot every N records"""
+
+        with self.lock:
+            self.records += 1
+            due = self.records % self.every == 0
+
+        if due:
+            self.snapshot()
+
+        return nanopub
+
+    def _take_snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            )
+        )
+
+    def snapshot(self) -> None:
+        """Write allocation growth since last snapshot"""
+
+        snapshot = self._take_snapshot()
+        (current, peak) = tracemalloc.get_traced_memory()
+
+        with self.lock:
+            stage_bytes = self.stage_bytes
+            self.stage_bytes = collections.Counter()
+            previous = self.previous
+            self.previous = snapshot
+
+            self.f.write(
+                f"== records: {self.records}  current: {current / 1024:.1f} KiB  "
+                f"peak: {peak / 1024:.1f} KiB\n"
+            )
+            self.f.write("Net allocations by stage:\n")
+            for (name, allocated) in stage_bytes.most_common():
+                self.f.write(f"  {name}: {allocated / 1024:.1f} KiB\n")
+
+            self.f.write(f"Top {self.top} allocation changes by line:\n")
+            for stat in snapshot.compare_to(previous, "lineno")[: self.top]:
+                self.f.write(f"  {stat}\n")
+            self.f.write("\n")
+            self.f.flush()
+
+    def close(self) -> None:
+        self.snapshot()
+        tracemalloc.stop()
+        self.f.close()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3.6
+# -*- coding: utf-8 -*-
+
+""" Select nanopubs right after reading - filter, sample and limit
+
+Filter expressions are compiled once into predicate functions so the per-record
+cost is only the field lookups and comparisons.
+
+Usage example:
+    selector = Selector(filters=["metadata.project=ABC"], sample=0.01, seed=42, limit=10000)
+    for nanopub in selector.select(read_nanopubs(input_fn), input_fn):
+        ...
+"""
+import random
+import re
+import threading
+from typing import Any, Callable, Iterable, Iterator, List, MutableMapping, Optional
+
+Nanopub = MutableMapping[str, Any]
+Predicate = Callable[[Nanopub], bool]
+
+FILTER_RE = re.compile(r"^\s*([\w.:\-]+)\s*(?:(!=|=|~)\s*(.*?))?\s*$")
+
+
+def _to_str(value: Any) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def compile_path(path: str) -> Callable[[Nanopub], List[Any]]:
+    """Compile dotted field path, e.g. metadata.project, into a value getter
+
+    Paths are relative to nanopub["nanopub"] and step into lists, so
+    annotations.type returns the type of every annotation.
+    """
+
+    keys = path.split(".")
+    if keys[0] == "nanopub":
+        keys = keys[1:]
+
+    def get_values(nanopub: Nanopub) -> List[Any]:
+        values = [nanopub.get("nanopub", {})]
+        for key in keys:
+            next_values = []
+            for value in values:
+                items = value if isinstance(value, list) else [value]
+                for item in items:
+                    if isinstance(item, dict) and key in item:
+                        next_values.append(item[key])
+            values = next_values
+            if not values:
+                return values
+
+        flat_values = []
+        for value in values:
+            if isinstance(value, list):
+                flat_values.extend(value)
+            else:
+                flat_values.append(value)
+
+        return flat_values
+
+    return get_values
+
+
+def compile_filter(expr: str) -> Predicate:
+    """Compile filter expression into a nanopub predicate
+
+    Expression formats (field paths are relative to the nanopub):
+        field=value   any field value equals value, e.g. metadata.project=ABC
+        field!=value  no field value equals value
+        field~regex   any field value matches regex, e.g. citation.database.name~(?i)pubmed
+        field         field exists and is not empty
+    """
+
+    match = FILTER_RE.match(expr)
+    if not match:
+        raise ValueError(f"Cannot parse filter expression: {expr}")
+
+    (path, op, target) = match.groups()
+    get_values = compile_path(path)
+
+    if op is None:
+        return lambda nanopub: any(v not in (None, "", [], {}) for v in get_values(nanopub))
+
+    elif op == "=":
+        return lambda nanopub: any(_to_str(v) == target for v in get_values(nanopub))
+
+    elif op == "!=":
+        return lambda nanopub: all(_to_str(v) != target for v in get_values(nanopub))
+
+    try:
+        regex = re.compile(target)
+    except re.error as e:
+        raise ValueError(f"Bad regular expression in filter expression: {expr}  Error: {e}")
+
+    return lambda nanopub: any(regex.search(_to_str(v)) for v in get_values(nanopub))
+
+
+def compile_filters(exprs: Iterable[str]) -> Optional[Predicate]:
+    """Compile filter expressions into a single predicate - all must match"""
+
+    predicates = [compile_filter(expr) for expr in exprs]
+    if not predicates:
+        return None
+    elif len(predicates) == 1:
+        return predicates[0]
+
+    return lambda nanopub: all(predicate(nanopub) for predicate in predicates)
+
+
+class Selector(object):
+    """Filter, sample and limit nanopubs as they are read
+
+    Records without a nanopub, e.g. headers, are always passed through.  Sampling
+    is seeded per input file so results don't depend on worker scheduling.  The
+    limit is shared across all input files - readers stop once it is reached.
+    """
+
+    def __init__(
+        self,
+        filters: Iterable[str] = (),
+        sample: float = None,
+        seed: int = 0,
+        limit: int = None,
+    ):
+        self.predicate = compile_filters(filters)
+        self.sample = sample
+        self.seed = seed
+        self.limit = limit
+
+        self.selected = 0
+        self.lock = threading.Lock()
+
+    def limit_reached(self) -> bool:
+        return self.limit is not None and self.selected >= self.limit
+
+    def select(
+        self, nanopubs: Iterable[Nanopub], input_fn: str = "-", summary: dict = None
+    ) -> Iterator[Nanopub]:
+        """Yield selected nanopubs, counting skipped nanopubs in summary['filtered']"""
+
+        predicate = self.predicate
+        sample = self.sample
+        rng = random.Random(f"{self.seed}:{input_fn}")
+
+        for nanopub in nanopubs:
+            if "nanopub" not in nanopub:
+                yield nanopub
+                continue
+
+            if (predicate and not predicate(nanopub)) or (
+                sample is not None and rng.random() >= sample
+            ):
+                if summary is not None:
+                    summary["filtered"] = summary.get("filtered", 0) + 1
+                continue
+
+            last = False
+            if self.limit is not None:
+                with self.lock:
+                    if self.selected >= self.limit:
+                        return
+                    self.selected += 1
+                    last = self.selected >= self.limit
+
+            yield nanopub
+
+            # Don't read another record once the limit is reached
+            if last:
+                return
@@ -0,0 +1,107 @@
+import threading
+
+import pytest
+
+from nptool.arango_sink import ArangoLoadError, ArangoSink, is_arango_url, parse_arango_url
+
+
+class StandInCollection(object):
+    """Stand-in for an ArangoDB collection supporting import_bulk"""
+
+    def __init__(self, fail_keys=()):
+        self.docs = {}
+        self.calls = []
+        self.fail_keys = set(fail_keys)
+        self.lock = threading.Lock()
+
+    def import_bulk(self, docs, on_duplicate="error", halt_on_error=True, details=False):
+        result = {"created": 0, "updated": 0, "errors": 0, "details": []}
+        with self.lock:
+            self.calls.append(len(docs))
+            for (idx, doc) in enumerate(docs):
+                if doc["_key"] in self.fail_keys:
+                    assert not halt_on_error
+                    result["errors"] += 1
+                    result["details"].append(f"at position {idx}: invalid document")
+                elif doc["_key"] in self.docs:
+                    assert on_duplicate == "replace"
+                    result["updated"] += 1
+                else:
+                    result["created"] += 1
+                self.docs[doc["_key"]] = doc
+        return result
+
+
+def make_nanopub(idx):
+    return {"nanopub": {"id": idx}}
+
+
+def key_fn(nanopub):
+    return nanopub["nanopub"]["id"]
+
+
+def test_parse_arango_url():
+    assert is_arango_url("arango://belbio/nanopubs")
+    assert not is_arango_url("nanopubs.jsonl.gz")
+    assert parse_arango_url("arango://belbio/nanopubs") == ("belbio", "nanopubs")
+
+    with pytest.raises(ValueError):
+        parse_arango_url("arango://belbio")
+
+
+def test_arango_sink_batches_and_upserts():
+    coll = StandInCollection()
+    sink = ArangoSink(coll, key_fn=key_fn, batch_size=10, parallel=3)
+
+    sink.write({"header": "not a nanopub"})
+    for idx in range(25):
+        sink.write(make_nanopub(idx))
+    for idx in range(5):
+        sink.write(make_nanopub(idx))
+    sink.close()
+
+    assert sorted(coll.calls) == [10, 10, 10]
+    assert set(coll.docs) == {str(idx) for idx in range(25)}
+    assert coll.docs["3"]["nanopub"] == {"id": 3}
+    assert sink.stats["created"] == 25
+    assert sink.stats["updated"] == 5
+    assert sink.stats["batches"] == 3
+
+
+def test_arango_sink_close_raises_on_nanopubs_without_key():
+    coll = StandInCollection()
+    sink = ArangoSink(coll, key_fn=key_fn, batch_size=10)
+
+    sink.write({"nanopub": {"type": "no id"}})
+    sink.write(make_nanopub(1))
+    with pytest.raises(ArangoLoadError, match="skipped without key: 1"):
+        sink.close()
+
+    assert set(coll.docs) == {"1"}
+    assert sink.stats["skipped"] == 1
+
+
+def test_arango_sink_close_raises_on_errors():
+    coll = StandInCollection(fail_keys={"3"})
+    sink = ArangoSink(coll, key_fn=key_fn, batch_size=10)
+    for idx in range(5):
+        sink.write(make_nanopub(idx))
+
+    with pytest.raises(ArangoLoadError):
+        sink.close()
+    assert sink.stats["errors"] == 1
+    assert sink.stats["created"] == 4
+
+
+def test_arango_sink_close_raises_on_failed_batches():
+    class FailingCollection(object):
+        def import_bulk(self, docs, **kwargs):
+            raise ConnectionError("connection refused")
+
+    sink = ArangoSink(FailingCollection(), key_fn=key_fn, batch_size=2)
+    for idx in range(5):
+        sink.write(make_nanopub(idx))
+
+    with pytest.raises(ArangoLoadError):
+        sink.close()
+    assert sink.stats["failed_batches"] == 3
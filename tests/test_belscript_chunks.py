@@ -0,0 +1,88 @@
+import pytest
+
+try:
+    import bel.nanopub.belscripts
+    from nptool.belscript_chunks import (
+        CHUNK_END,
+        annotation_key,
+        belscript_statements,
+        parse_chunk,
+        split_belscript,
+    )
+except Exception as e:  # bel requires a BELBio configuration to import
+    pytest.skip(f"bel not available: {e}", allow_module_level=True)
+
+
+BELSCRIPT = """SET DOCUMENT Name = "Test"
+SET DOCUMENT Version = "1.0"
+DEFINE NAMESPACE HGNC AS URL "http://example.com/hgnc.belns"
+
+SET STATEMENT_GROUP = "Group 1"
+SET Citation = {"PubMed","Title 1","1001","","",""}
+SET Evidence = "multi line
+   evidence 1"
+SET Species = "9606"
+p(HGNC:A) increases p(HGNC:B)
+p(HGNC:C) increases \\
+  p(HGNC:D)
+
+SET Citation = {"PubMed","Title 2","1002","","",""}
+SET Support = "Evidence 2"
+SET Cell = {"a", "b"}
+p(HGNC:E) decreases p(HGNC:F) // comment
+UNSET Species
+p(HGNC:G) increases p(HGNC:H)
+UNSET STATEMENT_GROUP
+
+SET Citation = {"PubMed","Title 3","1003","","",""}
+SET Support = "Evidence 3"
+p(HGNC:I) increases p(HGNC:J)
+
+SET Citation = {"PubMed","Title 4","1004","","",""}
+SET Cell = "c"
+p(HGNC:K) increases \\
+p(HGNC:M) \\  
+UNSET ALL
+p(HGNC:N) increases p(HGNC:L)
+
+SET Citation = {"PubMed","Title 5","1005","","",""}
+p(HGNC:O) increases p(HGNC:P)
+
+SET Citation = {"PubMed","Title 6","1006","","",""}
+p(HGNC:Q) increases p(HGNC:R)
+"""
+
+
+def test_split_belscript_matches_sequential_parse():
+    lines = BELSCRIPT.splitlines(keepends=True)
+    sequential = list(bel.nanopub.belscripts.parse_belscript(iter(lines)))
+
+    for chunk_size in [1, 5, 10, 1000]:
+        chunks = list(split_belscript(iter(lines), chunk_size))
+        chunked = [nanopub for chunk in chunks for nanopub in parse_chunk(chunk)]
+        assert chunked == sequential
+
+    chunks = list(split_belscript(iter(lines), 1))
+    assert len(chunks) == 8
+    assert all(chunk[-1] == CHUNK_END for chunk in chunks[:-1])
+    # Active context is carried into the next chunk
+    assert chunks[2][0].startswith("SET STATEMENT_GROUP")
+
+
+def test_belscript_statements():
+    lines = BELSCRIPT.splitlines(keepends=True)
+    statements = list(belscript_statements(iter(lines)))
+
+    assert [line for (stmt, raw) in statements for line in raw] == lines
+    # Assertion lines skip the parser's line handling, multi-line statements don't
+    assert ("", ["p(HGNC:A) increases p(HGNC:B)\n"]) in statements
+    assert ("p(HGNC:C) increases   p(HGNC:D)\n", lines[10:12]) in statements
+    assert ('SET Evidence = "multi line evidence 1"', lines[6:8]) in statements
+
+
+def test_annotation_key():
+    assert annotation_key('SET Citation = {"PubMed","Title","1001","","",""}') == "citation"
+    assert annotation_key('SET Support = "text"') == "evidence"
+    assert annotation_key('SET STATEMENT_GROUP = "Group 1"') == "statement_group"
+    assert annotation_key('SET Cell = {"a", "b"}') == "Cell"
+    assert annotation_key("SET DOCUMENT") is None
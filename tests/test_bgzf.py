@@ -0,0 +1,148 @@
+import gzip
+import json
+import os
+
+import pytest
+
+from nptool.bgzf import (
+    BgzfWriter,
+    IndexedReader,
+    bgzf_copy_fn,
+    build_index,
+    index_fn,
+    is_bgzf,
+    load_index,
+    locate,
+    plan_tasks,
+    recompress,
+)
+
+
+def make_nanopubs():
+    # Include records larger than a block to check records spanning blocks
+    sizes = [10, 100, 1000, 70000, 200000]
+    return [{"nanopub": {"id": idx, "pad": "x" * sizes[idx % 7 % 5]}} for idx in range(300)]
+
+
+def write_bgzf(fn, nanopubs):
+    with BgzfWriter(fn) as f:
+        for nanopub in nanopubs:
+            f.write(json.dumps(nanopub) + "\n")
+
+
+def test_bgzf_is_readable_as_gzip(tmpdir):
+    fn = str(tmpdir.join("nanopubs.jsonl.gz"))
+    nanopubs = make_nanopubs()
+    write_bgzf(fn, nanopubs)
+
+    assert is_bgzf(fn)
+    with gzip.open(fn, "rt") as f:
+        assert [json.loads(line) for line in f] == nanopubs
+
+    index = load_index(fn)
+    assert index["records"] == 300
+    assert index["blocks"][0] == [0, 0]
+
+
+def test_build_index(tmpdir):
+    nanopubs = make_nanopubs()
+
+    bgzf_fn = str(tmpdir.join("bgzf.jsonl.gz"))
+    write_bgzf(bgzf_fn, nanopubs)
+    written_index = load_index(bgzf_fn)
+    os.remove(index_fn(bgzf_fn))
+
+    assert load_index(bgzf_fn) is None
+    assert build_index(bgzf_fn)["blocks"] == written_index["blocks"]
+
+    # Plain gzip is copied as BGZF, the original is unchanged
+    gzip_fn = str(tmpdir.join("gzip.jsonl.gz"))
+    with gzip.open(gzip_fn, "wt") as f:
+        for nanopub in nanopubs:
+            f.write(json.dumps(nanopub) + "\n")
+    with open(gzip_fn, "rb") as f:
+        original = f.read()
+
+    with pytest.raises(ValueError):
+        build_index(gzip_fn)
+
+    bgzf_fn = bgzf_copy_fn(gzip_fn)
+    assert bgzf_fn == str(tmpdir.join("gzip.bgzf.jsonl.gz"))
+    assert recompress(gzip_fn, bgzf_fn)["blocks"] == written_index["blocks"]
+    assert is_bgzf(bgzf_fn)
+    with open(gzip_fn, "rb") as f:
+        assert f.read() == original
+    assert not os.path.exists(index_fn(gzip_fn))
+
+
+def test_recompress_failure_removes_partial_copy(tmpdir):
+    gzip_fn = str(tmpdir.join("bad.jsonl.gz"))
+    with open(gzip_fn, "wb") as f:
+        f.write(gzip.compress(b'{"a": 1}\n' * 1000)[:-20])
+
+    with pytest.raises(EOFError):
+        recompress(gzip_fn, bgzf_copy_fn(gzip_fn))
+
+    assert sorted(os.listdir(str(tmpdir))) == ["bad.jsonl.gz"]
+
+
+def test_stale_index_is_ignored(tmpdir):
+    fn = str(tmpdir.join("nanopubs.jsonl.gz"))
+    write_bgzf(fn, make_nanopubs())
+
+    with open(fn, "ab") as f:
+        f.write(gzip.compress(b"{}\n"))
+
+    assert load_index(fn) is None
+
+
+def test_indexed_reads(tmpdir):
+    fn = str(tmpdir.join("nanopubs.jsonl.gz"))
+    nanopubs = make_nanopubs()
+    write_bgzf(fn, nanopubs)
+    index = load_index(fn)
+
+    (voffset, skip) = locate(index, 150)
+    assert skip >= 0
+    assert sum([count for (voffset, skip, count) in plan_tasks(index, 10, 25)]) == 290
+
+    reader = IndexedReader(workers=1)
+    for start in [0, 1, 150, 299, 300]:
+        assert list(reader.read(fn, index, start)) == nanopubs[start:]
+
+    reader = IndexedReader(workers=2, records_per_task=23)
+    try:
+        assert list(reader.read(fn, index, 7)) == nanopubs[7:]
+    finally:
+        reader.close()
+
+
+def test_blank_lines_are_not_records(tmpdir):
+    fn = str(tmpdir.join("blank.jsonl.gz"))
+    with gzip.open(fn, "wt") as f:
+        f.write('{"a":1}\n\n{"a":2}\n')
+
+    bgzf_fn = bgzf_copy_fn(fn)
+    assert recompress(fn, bgzf_fn)["records"] == 2
+    assert list(IndexedReader(workers=1).read(bgzf_fn, load_index(bgzf_fn), 1)) == [{"a": 2}]
+
+    # Blank lines, including whitespace longer than a block, between records spanning blocks
+    nanopubs = make_nanopubs()[:40]
+    fn = str(tmpdir.join("blanks.jsonl.gz"))
+    with BgzfWriter(fn) as f:
+        for (idx, nanopub) in enumerate(nanopubs):
+            f.write("\n" * (idx % 3) + " " * 70000 * (idx % 4 == 1) + "\n")
+            f.write(json.dumps(nanopub) + "\n\n")
+    written_index = load_index(fn)
+    assert written_index["records"] == 40
+
+    os.remove(index_fn(fn))
+    assert build_index(fn) == written_index
+
+    reader = IndexedReader(workers=2, records_per_task=3)
+    try:
+        for start in [0, 1, 13, 39, 40]:
+            assert list(reader.read(fn, written_index, start)) == nanopubs[start:]
+    finally:
+        reader.close()
+    assert list(IndexedReader(workers=1).read(fn, written_index, 5)) == nanopubs[5:]
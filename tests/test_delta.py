@@ -0,0 +1,139 @@
+import copy
+import os
+import sqlite3
+
+from nptool.delta import DELETED_FN, DeltaState, mark_not_reusable
+
+
+def make_nanopub(idx, evidence="evidence"):
+    return {"nanopub": {"id": idx, "evidence": evidence, "metadata": {}}}
+
+
+def np_hash(nanopub):
+    # Only transformed outputs have the hash used to key them in the output
+    assert nanopub["nanopub"]["metadata"]["transformed"]
+    return f"hash{nanopub['nanopub']['id']}"
+
+
+class Transform(object):
+    """Counts calls and modifies the nanopub in place like the transform stages"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, nanopub):
+        self.calls += 1
+        nanopub["nanopub"]["metadata"]["transformed"] = True
+        return nanopub
+
+
+def run(state_dir, nanopubs, options=None):
+    transform = Transform()
+    delta = DeltaState(str(state_dir), options or {"bel1": True}, np_hash_fn=np_hash)
+    outputs = [delta.transform(copy.deepcopy(nanopub), transform) for nanopub in nanopubs]
+    stats = delta.close()
+    return (outputs, transform.calls, stats)
+
+
+def test_delta_reuses_unchanged_nanopubs(tmpdir):
+    nanopubs = [make_nanopub(idx) for idx in range(10)]
+
+    (first, calls, stats) = run(tmpdir, nanopubs)
+    assert calls == 10
+    assert stats == {"reused": 0, "transformed": 10, "deleted": 0}
+
+    # Unchanged input - outputs reused
+    (second, calls, stats) = run(tmpdir, nanopubs)
+    assert calls == 0
+    assert second == first
+    assert stats["reused"] == 10
+
+    # One changed, one new, two deleted
+    nanopubs = nanopubs[2:] + [make_nanopub(10)]
+    nanopubs[0] = make_nanopub(2, evidence="changed")
+    (third, calls, stats) = run(tmpdir, nanopubs)
+    assert calls == 2
+    assert third[0]["nanopub"]["evidence"] == "changed"
+    assert stats == {"reused": 7, "transformed": 2, "deleted": 2}
+    with open(os.path.join(str(tmpdir), DELETED_FN)) as f:
+        assert f.read().split() == ["hash0", "hash1"]
+
+
+def test_delta_options_change_transforms_all(tmpdir):
+    nanopubs = [make_nanopub(idx) for idx in range(5)]
+
+    run(tmpdir, nanopubs, {"bel1": True})
+    (outputs, calls, stats) = run(tmpdir, nanopubs, {"bel1": True, "fmt": "short"})
+
+    assert calls == 5
+    assert stats["deleted"] == 0
+
+
+def test_delta_tracks_only_nanopubs_with_output(tmpdir):
+    def drop_odd(nanopub):
+        return None if nanopub["nanopub"]["id"] % 2 else Transform()(nanopub)
+
+    header = {"header": {"nanopub_type": "bel"}}
+    nanopubs = [make_nanopub(idx) for idx in range(4)]
+    delta = DeltaState(str(tmpdir), {}, np_hash_fn=np_hash)
+    assert delta.transform(dict(header), lambda record: record) == header
+    outputs = [delta.transform(copy.deepcopy(nanopub), drop_odd) for nanopub in nanopubs]
+    delta.close()
+    assert [output is None for output in outputs] == [False, True, False, True]
+
+    # Dropped nanopubs have no hash so only nanopub 2 is reported as deleted
+    delta = DeltaState(str(tmpdir), {}, np_hash_fn=np_hash)
+    delta.transform(dict(header), lambda record: record)
+    delta.transform(copy.deepcopy(nanopubs[0]), drop_odd)
+    stats = delta.close()
+
+    assert stats == {"reused": 1, "transformed": 0, "deleted": 1}
+    with open(os.path.join(str(tmpdir), DELETED_FN)) as f:
+        assert f.read().split() == ["hash2"]
+
+
+def test_delta_does_not_reuse_failed_lookups(tmpdir):
+    nanopubs = [make_nanopub(idx) for idx in range(4)]
+    failing = {1}
+
+    def lookup_transform(nanopub):
+        nanopub = Transform()(nanopub)
+        if nanopub["nanopub"]["id"] in failing:
+            nanopub["nanopub"]["metadata"]["species"] = "TBD:human"
+            mark_not_reusable()
+        return nanopub
+
+    def run_lookups():
+        delta = DeltaState(str(tmpdir), {}, np_hash_fn=np_hash)
+        outputs = [
+            delta.transform(copy.deepcopy(nanopub), lookup_transform) for nanopub in nanopubs
+        ]
+        return (outputs, delta.close())
+
+    (outputs, stats) = run_lookups()
+    assert outputs[1]["nanopub"]["metadata"]["species"] == "TBD:human"
+
+    # Failed lookup is retried, its hash is not reported as deleted
+    failing.clear()
+    (outputs, stats) = run_lookups()
+    assert stats == {"reused": 3, "transformed": 1, "deleted": 0}
+    assert "species" not in outputs[1]["nanopub"]["metadata"]
+
+    (outputs, stats) = run_lookups()
+    assert stats["reused"] == 4
+
+
+def test_delta_adds_reusable_column(tmpdir):
+    db = sqlite3.connect(str(tmpdir.join("delta.sqlite")))
+    # State written before the reusable column was added
+    db.execute(
+        "CREATE TABLE records (key TEXT PRIMARY KEY, np_hash TEXT, output TEXT, run INTEGER)"
+    )
+    db.execute("CREATE TABLE runs (run INTEGER PRIMARY KEY)")
+    db.execute("INSERT INTO records VALUES ('key', 'hash', NULL, 1)")
+    db.execute("INSERT INTO runs VALUES (1)")
+    db.commit()
+    db.close()
+
+    (outputs, calls, stats) = run(tmpdir, [make_nanopub(0)])
+    assert stats == {"reused": 0, "transformed": 1, "deleted": 1}
@@ -0,0 +1,75 @@
+import os
+
+from nptool.input_files import (
+    expand_input_fns,
+    find_output_conflicts,
+    glob_root,
+    mirror_output_fn,
+)
+
+
+def make_tree(tmpdir):
+    for fn in ["a.jsonl.gz", "b.belscript", "notes.txt", "sub/c.json", "sub/d.yaml"]:
+        path = tmpdir.join(fn)
+        path.ensure()
+    return str(tmpdir)
+
+
+def test_expand_directory(tmpdir):
+    root = make_tree(tmpdir)
+
+    files = expand_input_fns([root])
+
+    assert [rel_fn for (fn, rel_fn) in files] == [
+        "a.jsonl.gz",
+        "b.belscript",
+        os.path.join("sub", "c.json"),
+        os.path.join("sub", "d.yaml"),
+    ]
+    assert files[0][0] == os.path.join(root, "a.jsonl.gz")
+
+
+def test_expand_glob_and_filelist(tmpdir):
+    root = make_tree(tmpdir)
+
+    files = expand_input_fns([os.path.join(root, "**", "*.json*")])
+    assert [rel_fn for (fn, rel_fn) in files] == ["a.jsonl.gz", os.path.join("sub", "c.json")]
+
+    filelist = tmpdir.join("files.txt")
+    filelist.write("# nanopub files\n{}\n\n{}\n".format(
+        os.path.join(root, "b.belscript"), os.path.join(root, "a.jsonl.gz")
+    ))
+    files = expand_input_fns(["@" + str(filelist), os.path.join(root, "a.jsonl.gz")])
+    assert [rel_fn for (fn, rel_fn) in files] == ["b.belscript", "a.jsonl.gz"]
+
+
+def test_expand_stdin():
+    assert expand_input_fns(["-"]) == [("-", "-")]
+
+
+def test_glob_root():
+    assert glob_root(os.path.join("data", "2020", "*.jsonl.gz")) == os.path.join("data", "2020")
+    assert glob_root("*.belscript") == "."
+
+
+def test_mirror_output_fn():
+    assert mirror_output_fn("out", os.path.join("sub", "x.belscript")) == os.path.join(
+        "out", "sub", "x.jsonl.gz"
+    )
+    assert mirror_output_fn("out", "y.jsonl.gz") == os.path.join("out", "y.jsonl.gz")
+    assert mirror_output_fn("out", "-") == os.path.join("out", "stdin.jsonl.gz")
+
+
+def test_find_output_conflicts(tmpdir):
+    for fn in ["d1/x.json", "d1/x.belscript", "d1/y.json", "d2/x.json", "d2/z.json"]:
+        tmpdir.join(fn).ensure()
+
+    files = expand_input_fns([str(tmpdir.join("d1")), str(tmpdir.join("d2"))])
+
+    conflicts = find_output_conflicts("out", files)
+    assert list(conflicts) == [os.path.join("out", "x.jsonl.gz")]
+    assert sorted(conflicts[os.path.join("out", "x.jsonl.gz")]) == sorted(
+        str(tmpdir.join(fn)) for fn in ["d1/x.json", "d1/x.belscript", "d2/x.json"]
+    )
+
+    assert find_output_conflicts("out", expand_input_fns([str(tmpdir.join("d1", "y.json"))])) == {}
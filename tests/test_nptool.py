@@ -1,5 +1,73 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from click.testing import CliRunner
+
 from nptool import __version__
 
 
+def import_nptool():
+    try:
+        import nptool.nptool
+    except Exception as e:  # bel requires a BELBio configuration to import
+        pytest.skip(f"bel not available: {e}")
+
+    return nptool.nptool
+
+
 def test_version():
     assert __version__ == '0.1.0'
+
+
+def test_migrate1to2_worker_threads(monkeypatch):
+    nptool = import_nptool()
+
+    class SharedBEL(object):
+        ast = None
+
+    bo = SharedBEL()
+
+    def migrate_into_triple(belstr):
+        # Same pattern as bel.lang.migrate_1_2 - parse stored on a module-level BEL object
+        bo.ast = belstr
+        time.sleep(0.001)
+        return {"subject": bo.ast}
+
+    monkeypatch.setattr(nptool.bel.lang.migrate_1_2, "migrate_into_triple", migrate_into_triple)
+
+    def make_nanopub(idx):
+        assertion = {"subject": f"p(HGNC:A{idx})", "relation": "increases", "object": "p(HGNC:B)"}
+        return {"nanopub": {"assertions": [assertion] * 5, "type": {"name": "BEL"}}}
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        nanopubs = list(executor.map(nptool.migrate1to2, map(make_nanopub, range(40))))
+
+    for (idx, nanopub) in enumerate(nanopubs):
+        assert nanopub["nanopub"]["type"]["version"] == "2.1.0"
+        for assertion in nanopub["nanopub"]["assertions"]:
+            assert assertion == {"subject": f"p(HGNC:A{idx}) increases p(HGNC:B)"}
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        ["--filter", "metadata.project=ABC"],
+        ["--sample", "0.01"],
+        ["--limit", "10"],
+        ["--offset", "5"],
+    ],
+)
+def test_delta_requires_full_input(tmpdir, options):
+    nptool = import_nptool()
+    input_fn = tmpdir.join("nanopubs.jsonl")
+    input_fn.write("")
+    state_dir = tmpdir.join("state")
+
+    result = CliRunner().invoke(
+        nptool.main, ["-i", str(input_fn), "--delta", str(state_dir)] + options
+    )
+
+    assert result.exit_code == 2
+    assert options[0] in result.output
+    assert not state_dir.exists()
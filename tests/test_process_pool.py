@@ -0,0 +1,12 @@
+from nptool.process_pool import start_process_pool
+
+
+def test_start_process_pool_forks_all_workers():
+    pool = start_process_pool(3)
+    try:
+        # Workers already exist, so later submits from worker threads don't fork
+        assert len(pool._processes) == 3
+        assert pool.submit(sum, [1, 2]).result() == 3
+        assert len(pool._processes) == 3
+    finally:
+        pool.shutdown()
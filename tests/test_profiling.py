@@ -0,0 +1,125 @@
+import pstats
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from nptool.profiling import CpuProfiler, MemProfiler
+
+
+def busy_transform(seconds=0.2):
+    end = time.time() + seconds
+    total = 0
+    while time.time() < end:
+        total += sum(range(1000))
+    return total
+
+
+def test_cpu_profiler_pstats(tmpdir):
+    path = str(tmpdir.join("nptool.pstats"))
+
+    profiler = CpuProfiler(path)
+    assert profiler.run(busy_transform, 0.05) > 0
+    profiler.run(busy_transform, 0.05)
+    profiler.close()
+
+    stats = pstats.Stats(path)
+    assert any(func[2] == "busy_transform" for func in stats.stats)
+
+
+def test_cpu_profiler_pstats_worker_threads(tmpdir):
+    path = str(tmpdir.join("nptool.pstats"))
+    active = []
+    overlaps = []
+
+    def run_file(idx):
+        active.append(idx)
+        overlaps.append(len(active) > 1)
+        busy_transform(0.02)
+        active.remove(idx)
+        return idx
+
+    # A single cProfile profiler - runs don't overlap (Python 3.12+ rejects a second one)
+    profiler = CpuProfiler(path)
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        results = list(executor.map(lambda idx: profiler.run(run_file, idx), range(6)))
+    profiler.close()
+
+    assert results == list(range(6))
+    assert not any(overlaps)
+    stats = pstats.Stats(path)
+    calls = [stat[1] for (func, stat) in stats.stats.items() if func[2] == "busy_transform"]
+    assert calls == [6]
+
+
+def test_cpu_profiler_collapsed(tmpdir):
+    path = str(tmpdir.join("nptool.folded"))
+
+    profiler = CpuProfiler(path, interval=0.001)
+    profiler.run(busy_transform)
+    profiler.close()
+
+    with open(path) as f:
+        lines = f.read().splitlines()
+
+    assert lines
+    (stack, count) = lines[0].rsplit(" ", 1)
+    assert int(count) > 0
+    assert "test_profiling:busy_transform" in stack
+
+
+def test_mem_profiler(tmpdir):
+    path = str(tmpdir.join("memprofile.txt"))
+    hold = []
+
+    def grow(nanopub):
+        hold.append("x" * 10000)
+        return nanopub
+
+    profiler = MemProfiler(path, every=5)
+    stages = profiler.wrap_stages([("grow", grow), ("drop", lambda nanopub: None)])
+    assert [name for (name, fn) in stages] == ["memprofile", "grow", "drop"]
+
+    for idx in range(10):
+        nanopub = {"nanopub": {"id": idx}}
+        for (name, stage) in stages:
+            nanopub = stage(nanopub)
+            if nanopub is None:
+                break
+    profiler.close()
+
+    with open(path) as f:
+        report = f.read()
+
+    assert report.count("== records:") == 3
+    assert "grow:" in report
+    assert "test_profiling.py" in report
+
+
+def test_mem_profiler_nested_stages(tmpdir):
+    path = str(tmpdir.join("memprofile.txt"))
+    hold = []
+
+    def grow(nanopub):
+        hold.append("x" * 10000)
+        return nanopub
+
+    profiler = MemProfiler(path, every=100)
+    inner = profiler.wrap_stages([("grow", grow)], count_records=False)
+    assert [name for (name, fn) in inner] == ["grow"]
+
+    def outer(nanopub):
+        for (name, stage) in inner:
+            nanopub = stage(nanopub)
+        return nanopub
+
+    stages = profiler.wrap_stages([("delta", outer)])
+    for idx in range(3):
+        for (name, stage) in stages:
+            stage({"nanopub": {"id": idx}})
+    profiler.close()
+
+    with open(path) as f:
+        report = f.read()
+
+    assert "== records: 3" in report
+    assert "  delta:" in report
+    assert "  grow:" in report
@@ -0,0 +1,82 @@
+import pytest
+
+from nptool.selection import Selector, compile_filter, compile_filters
+
+
+def make_nanopub(idx, project="ABC", database="PubMed"):
+    return {
+        "nanopub": {
+            "id": idx,
+            "citation": {"database": {"name": database, "id": str(idx)}},
+            "annotations": [
+                {"type": "Species", "id": "TAX:9606"},
+                {"type": "Anatomy", "id": "UBERON:1"},
+            ],
+            "metadata": {"project": project, "gd:published": True},
+        }
+    }
+
+
+def test_compile_filter():
+    nanopub = make_nanopub(1)
+
+    assert compile_filter("metadata.project=ABC")(nanopub)
+    assert compile_filter("nanopub.metadata.project=ABC")(nanopub)
+    assert not compile_filter("metadata.project=XYZ")(nanopub)
+    assert compile_filter("metadata.project!=XYZ")(nanopub)
+    assert compile_filter("metadata.gd:published=true")(nanopub)
+    assert compile_filter("citation.database.name~(?i)^pubmed$")(nanopub)
+    assert compile_filter("annotations.type=Anatomy")(nanopub)
+    assert not compile_filter("annotations.type!=Anatomy")(nanopub)
+    assert compile_filter("metadata.project")(nanopub)
+    assert not compile_filter("metadata.missing")(nanopub)
+
+
+def test_compile_filter_errors():
+    with pytest.raises(ValueError):
+        compile_filter("metadata project = ABC")
+
+    with pytest.raises(ValueError):
+        compile_filter("metadata.project~(")
+
+
+def test_compile_filters():
+    assert compile_filters([]) is None
+
+    predicate = compile_filters(["metadata.project=ABC", "citation.database.name=PubMed"])
+    assert predicate(make_nanopub(1))
+    assert not predicate(make_nanopub(1, database="DOI"))
+
+
+def test_selector_filter_and_limit():
+    nanopubs = [{"header": 1}]
+    nanopubs += [make_nanopub(idx, project=["ABC", "XYZ"][idx % 2]) for idx in range(20)]
+    read = []
+
+    def reader():
+        for nanopub in nanopubs:
+            read.append(nanopub)
+            yield nanopub
+
+    selector = Selector(filters=["metadata.project=ABC"], limit=3)
+    summary = {}
+    selected = list(selector.select(reader(), "test.jsonl", summary))
+
+    assert selected[0] == {"header": 1}
+    assert [nanopub["nanopub"]["id"] for nanopub in selected[1:]] == [0, 2, 4]
+    assert summary["filtered"] == 2
+    assert len(read) == 6
+    assert selector.limit_reached()
+    assert list(selector.select(iter(nanopubs), "other.jsonl")) == [{"header": 1}]
+
+
+def test_selector_sample_is_seeded():
+    nanopubs = [make_nanopub(idx) for idx in range(1000)]
+
+    first = list(Selector(sample=0.1, seed=7).select(nanopubs, "test.jsonl"))
+    second = list(Selector(sample=0.1, seed=7).select(nanopubs, "test.jsonl"))
+    other = list(Selector(sample=0.1, seed=8).select(nanopubs, "test.jsonl"))
+
+    assert first == second
+    assert first != other
+    assert 50 < len(first) < 150